@@ -1,4 +1,6 @@
 # Easy way to debug is to run this file
 from sql_runner import runner
 
-runner.main()
+# Dependency parsing processes import this module again when they're spawned instead of forked (macOS, Windows)
+if __name__ == '__main__':
+    runner.main()
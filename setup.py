@@ -34,6 +34,7 @@ setup(
         'postgres': ['psycopg2-binary'],
         'azuredwh': ['pyodbc'],
         'bigquery': ['google-cloud-bigquery==2.12.0'],
+        'test': ['pytest'],
     },
 
     packages=find_packages(),
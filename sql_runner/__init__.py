@@ -5,3 +5,11 @@ class ExecutionType(str, enum.Enum):
     execute="execute"
     staging="staging"
     test="test"
+    validate="validate"
+    estimate="estimate"
+
+
+class ExecutionError(Exception):
+    """ A statement failed. Details were already written to stderr
+    """
+    pass
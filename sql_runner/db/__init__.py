@@ -1,5 +1,13 @@
+import atexit
 import os
+import random
 import re
+import sys
+import threading
+import time
+import traceback
+from bisect import bisect_right
+from textwrap import dedent
 from types import SimpleNamespace, FunctionType
 from typing import List, Dict, Union, Tuple, Set, Iterator, Iterable, Callable, Any
 from functools import partial, lru_cache
@@ -8,11 +16,11 @@ import io
 import json
 import sqlparse
 
-from sql_runner import tests, parsing, ExecutionType
+from sql_runner import tests, parsing, ExecutionType, ExecutionError
 
 
 class FakeCursor:
-    def execute(self, statement: str):
+    def execute(self, statement: str, **kwargs):
         print("\n>>>>>>>>>> BEGIN STATEMENT >>>>>>>>>")
         print(statement)
         print(">>>>>>>>>>> END STATEMENT >>>>>>>>>>\n")
@@ -27,9 +35,69 @@ class FakeCursor:
         return None
 
 
+class Catalog:
+    """ Snapshot of the schemata and relations (tables and views) of the database, loaded with a single catalog query
+    at the start of a run, and updated with the relations that the run builds. Names are compared case-insensitively.
+    Schemata that the run creates are not added; the statement optimizer creates each of them once
+    """
+    # Hand-written statements that can make the snapshot wrong
+    invalidating_pattern = re.compile(r'\b(DROP|RENAME|SWAP)\b', re.IGNORECASE)
+
+    def __init__(self, database: Union[str, None], rows: Iterable[Tuple[str, Union[str, None], Union[str, None]]]):
+        self.database: Union[str, None] = database
+        self.schemata: Set[str] = set()
+        # Kind of every relation, 'table' or 'view'
+        self.relations: Dict[Tuple[str, str], str] = {}
+        self.valid: bool = True
+        self.lock = threading.Lock()
+        for schema, relation, kind in rows:
+            self.schemata.add(Catalog.key(schema))
+            if relation is not None:
+                self.relations[(Catalog.key(schema), Catalog.key(relation))] = kind
+
+    @staticmethod
+    def key(name: str) -> str:
+        return name.strip('"`[]').lower()
+
+    def covers(self, database: Union[str, None]) -> bool:
+        """ Whether names in the database can be looked up
+        """
+        return self.valid and (database is None or self.database is not None
+                               and Catalog.key(database) == Catalog.key(self.database))
+
+    def has_schema(self, schema: str) -> bool:
+        return Catalog.key(schema) in self.schemata
+
+    def has_relation(self, schema: str, relation: str, kind: str = None) -> bool:
+        """ Whether the relation exists, as a relation of the kind if one is given
+        """
+        existing = self.relations.get((Catalog.key(schema), Catalog.key(relation)))
+        return existing is not None and (kind is None or existing == kind)
+
+    def set_relation(self, schema: str, relation: str, kind: Union[str, None]):
+        """ Record that the relation was built as a relation of the kind, or dropped if the kind is None
+        """
+        with self.lock:
+            if kind is None:
+                self.relations.pop((Catalog.key(schema), Catalog.key(relation)), None)
+            else:
+                self.relations[(Catalog.key(schema), Catalog.key(relation))] = kind
+
+    def invalidate(self):
+        """ Stop relying on the snapshot for the rest of the run
+        """
+        self.valid = False
+
+
 class Query(object):
 
     default_schema_suffix = '_mat'
+    # Suffix of the tables that are built before they're swapped in, with `swap_tables`
+    shadow_suffix = '__swap'
+    # Suffix of the tables with the new rows of `i` queries
+    incremental_suffix = '__incr'
+    # Snapshot of the existing schemata and relations, when the run has one
+    catalog: Union[Catalog, None] = None
 
     def __init__(self, config: SimpleNamespace, args: SimpleNamespace, all_created_entities: Set[Tuple[str, str]],
                  execution_type: ExecutionType, schema_name: str, table_name: str, action: str):
@@ -50,16 +118,90 @@ class Query(object):
         self.path: str = os.path.abspath(os.path.normpath(path))
         if not os.path.isfile(self.path):
             raise ValueError(f'file {self.path} does not exist')
-        with open(self.path, 'r', encoding=getattr(self.config, 'encoding', 'utf-8')) as f:
-            self.query: str = f.read()
+        # The SQL is read and parsed when it's first needed, and dropped again with `unload`
+        self._query: Union[str, None] = None
+        self._managed_statements: Union[List[parsing.Query], None] = None
+        self.load_lock = threading.Lock()
+
+    @property
+    def query(self) -> str:
+        """ SQL of the file
+        """
+        if self._query is None:
+            with self.load_lock:
+                if self._query is None:
+                    with open(self.path, 'r', encoding=getattr(self.config, 'encoding', 'utf-8')) as f:
+                        self._query = f.read()
+        return self._query
 
-        self.managed_statements: List[parsing.Query] = list(parsing.Query.get_queries(self.query))
+    @property
+    def managed_statements(self) -> List[parsing.Query]:
+        """ Parsed statements of the SQL file
+        """
+        if self._managed_statements is None:
+            query = self.query
+            with self.load_lock:
+                if self._managed_statements is None:
+                    self._managed_statements = list(parsing.Query.get_queries(
+                        query, lightweight=bool(getattr(self.config, 'lightweight_lexer', False))))
+        return self._managed_statements
+
+    def load(self):
+        """ Read and parse the SQL ahead of time, ex. in the background while other queries run
+        """
+        self.managed_statements
+
+    def unload(self):
+        """ Drop the SQL and its parsed statements, once the query is done
+        """
+        with self.load_lock:
+            self._query = None
+            self._managed_statements = None
 
     def __repr__(self):
         return f'{self.name} > {self.action}'
 
-    def get_statement_generator(self, statement_type: str) -> Callable[[ExecutionType], Iterable[str]]:
-        return getattr(self, statement_type)
+    @property
+    def idempotent(self) -> bool:
+        """ Whether the statements of this query can be repeated safely. Only `e` statements are written by hand
+        """
+        return self.action != 'e'
+
+    def get_statement_generator(self, statement_type: str) -> Callable[[], Iterable[str]]:
+        generator = getattr(self, statement_type)
+        # Generators leave out statements that the catalog snapshot knows are not needed, as `None`
+        return lambda: (stmt for stmt in generator() if stmt is not None)
+
+    def active_catalog(self) -> Union[Catalog, None]:
+        """ The catalog snapshot, if it's valid for the database of this query
+        """
+        if self.catalog is None or not self.catalog.covers(self.name_components.database):
+            return None
+        return self.catalog
+
+    def catalog_schema(self, mat: bool = False) -> str:
+        return self.name_components.schema + (self.schema_suffix if mat else '')
+
+    def schema_missing(self, mat: bool = False) -> bool:
+        """ Whether the schema (of the materialized view back-end) has to be created, as far as it's known
+        """
+        catalog = self.active_catalog()
+        return catalog is None or not catalog.has_schema(self.catalog_schema(mat))
+
+    def may_exist(self, kind: str = None, mat: bool = False) -> bool:
+        """ Whether the relation (of the materialized view back-end) can exist, as a relation of the kind if one is
+        given, and has to be dropped
+        """
+        catalog = self.active_catalog()
+        return catalog is None \
+            or catalog.has_relation(self.catalog_schema(mat), self.name_components.relation, kind)
+
+    def record_relation(self, kind: Union[str, None], mat: bool = False):
+        """ Update the catalog snapshot with the relation that the statements build
+        """
+        catalog = self.active_catalog()
+        if catalog is not None:
+            catalog.set_relation(self.catalog_schema(mat), self.name_components.relation, kind)
 
     @property
     def assertion(self) -> FunctionType:
@@ -231,6 +373,52 @@ class Query(object):
             unique_keys = []
         return unique_keys
 
+    def functional_comment(self, key: str, default: Any = None) -> Any:
+        """ Value of a key in the JSON functional comments of the query
+        """
+        for stmt in self.managed_statements:
+            for comment in stmt.comment_contents():
+                try:
+                    functional_comment = json.loads(comment)
+                except:
+                    continue
+                if isinstance(functional_comment, dict) and functional_comment.get(key) is not None:
+                    return functional_comment[key]
+        return default
+
+    @property
+    def incremental_filter(self) -> Union[str, None]:
+        """ Predicate that limits the rows that `i` queries merge, from the `"incremental_filter"` functional comment
+        """
+        return self.functional_comment('incremental_filter') or None
+
+    @property
+    def incremental_name(self) -> str:
+        """ Full name of the table with the new rows of `i` queries
+        """
+        return self.name + Query.incremental_suffix
+
+    def incremental_select_stmt(self, select_stmt: str = None) -> str:
+        """ `select_stmt`, limited to the rows that `incremental_filter` lets through. Pass `select_stmt` when it was
+        already rendered, since rendering it again would preprocess the names again
+        """
+        incremental_filter = self.incremental_filter
+        select_stmt = (select_stmt or self.select_stmt()).strip().rstrip(';')
+        if not incremental_filter:
+            return select_stmt
+        return f"""SELECT *
+        FROM (
+        {select_stmt}
+        ) incremental_source
+        WHERE {incremental_filter}"""
+
+    def unique_keys_match(self, target: str, source: str) -> str:
+        """ Condition that matches rows of two relations by the unique keys
+        """
+        if not self.unique_keys:
+            raise Exception(f"'{self.name}' needs a `unique key (<key1, key2>)` functional comment for the `i` action")
+        return ' AND '.join(f'{target}.{key} = {source}.{key}' for key in self.unique_keys)
+
     def execute_stmt(self):
         """ Literal statement to execute
         """
@@ -266,74 +454,183 @@ class Query(object):
             extra_manipulations(dml)
         return str(dml)
 
+    def production_schema(self, mat: bool = False) -> str:
+        """ Full schema name (of the materialized view back-end) that execute runs build the relation in
+        """
+        components = SimpleNamespace(
+            database=self.config.auth["database"] if getattr(self.config, "explicit_database", False) else None,
+            schema=self.schema_name + self.schema_suffix if mat else self.schema_name
+        )
+        return '.'.join(c for c in (components.database, components.schema) if c)
+
+    def clone_stmt(self) -> Union[Iterable[str], None]:
+        """ Statements that create the relation as a zero-copy clone of its production version, for clone staging.
+        `None` when the DB can't clone it, so that it's built instead
+        """
+        return None
+
+    @property
+    def swap_tables(self) -> bool:
+        """ Whether tables are built under a shadow name and swapped in when they're complete, so that the previous
+        version stays available during the build. Enabled with `"swap_tables": true`
+        """
+        return bool(getattr(self.config, 'swap_tables', False))
+
+    @property
+    def shadow_relation(self) -> str:
+        return self.name_components.relation + Query.shadow_suffix
+
+    def shadow_name(self, mat: bool = False) -> str:
+        """ Full name that the table (of the materialized view back-end) is built under, before it's swapped in
+        """
+        return (self.name_mat if mat else self.name) + Query.shadow_suffix
+
+    def swap_stmt(self, mat: bool = False, then: Iterable[Union[str, None]] = ()) -> Tuple[Union[str, None], ...]:
+        """ Statements that replace the table (of the materialized view back-end) with the shadow table, followed by
+        `then`. Without `swap_tables`, only `then`
+        """
+        if not self.swap_tables:
+            return tuple(then)
+        name = self.name_mat if mat else self.name
+        following = '\n        '.join(f"{stmt.strip().rstrip(';')};" for stmt in then if stmt is not None)
+        # Sent as one request, so that it runs as a single transaction, and readers never miss the table
+        return (f"""
+        DROP TABLE IF EXISTS {name} CASCADE;
+        ALTER TABLE {self.shadow_name(mat)} RENAME TO {self.name_components.relation};
+        {following}""",)
+
     def create_view_stmt(self) -> Iterable[str]:
         """ Statement that creates a view out of `select_stmt`
         """
-        return (f"""
+        statements = (f"""
         CREATE SCHEMA IF NOT EXISTS {self.schema}
-        """,
+        """ if self.schema_missing() else None,
         f"""
         DROP VIEW IF EXISTS {self.name} CASCADE
-        """,
+        """ if self.may_exist() else None,
         f"""
         CREATE VIEW {self.name}
         AS
         {self.select_stmt()}
         """)
+        self.record_relation('view')
+        return statements
 
     def create_mock_relation_stmt(self) -> Iterable[str]:
         """ Statement that creates a mock relation out of `select_stmt`
         """
-        return (f"""
+        statements = (f"""
         CREATE SCHEMA IF NOT EXISTS {self.schema}
-        """,
+        """ if self.schema_missing() else None,
         f"""
         DROP TABLE IF EXISTS {self.name} CASCADE
-        """,
+        """ if self.may_exist() else None,
         f"""
         CREATE TABLE {self.name}
         AS
         {self.select_stmt(self.limit_0)}
         """)
+        self.record_relation('table')
+        return statements
+
+    def explain_stmt(self) -> Iterable[str]:
+        """ Statement that validates `select_stmt` against the existing sources, without creating anything
+        """
+        return f"""
+        EXPLAIN
+        {self.select_stmt()}
+        """,
 
     def create_table_stmt(self) -> Iterable[str]:
         """ Statement that creates a table out of `select_stmt`
         """
-        return (f"""
+        target = self.shadow_name() if self.swap_tables else self.name
+        statements = (f"""
         CREATE SCHEMA IF NOT EXISTS {self.schema}
-        """,
+        """ if self.schema_missing() else None,
         f"""
-        DROP TABLE IF EXISTS {self.name} CASCADE
-        """,
+        DROP TABLE IF EXISTS {target} CASCADE
+        """ if self.swap_tables or self.may_exist() else None,
         f"""
-        CREATE TABLE {self.name}
+        CREATE TABLE {target}
         AS
         {self.select_stmt()}
-        """)
+        """) + self.swap_stmt()
+        self.record_relation('table')
+        return statements
 
     def materialize_view_stmt(self) -> Iterable[str]:
         """ Statement that creates a "materialized" view, or equivalent, out of a `select_stmt`
         """
-        return (f"""
+        target = self.shadow_name(mat=True) if self.swap_tables else self.name_mat
+        statements = (f"""
         CREATE SCHEMA IF NOT EXISTS {self.schema_mat}
-        """,
+        """ if self.schema_missing(mat=True) else None,
         f"""
-        DROP TABLE IF EXISTS {self.name_mat} CASCADE
-        """,
+        DROP TABLE IF EXISTS {target} CASCADE
+        """ if self.swap_tables or self.may_exist(mat=True) else None,
         f"""
-        CREATE TABLE {self.name_mat}
+        CREATE TABLE {target}
         AS
         {self.select_stmt()}
-        """,
-        f"""
+        """) + self.swap_stmt(mat=True, then=(f"""
         DROP VIEW IF EXISTS {self.name} CASCADE
-        """,
+        """ if self.may_exist() else None,
         f"""
         CREATE VIEW {self.name}
         AS
         SELECT * FROM {self.name_mat}
+        """))
+        self.record_relation('table', mat=True)
+        self.record_relation('view')
+        return statements
+
+    def merge_stmt(self) -> Iterable[str]:
+        """ Statement that creates a table out of `select_stmt` on its first build, and merges the new rows of
+        `incremental_select_stmt` by the unique keys after that
+        """
+        match = self.unique_keys_match(self.name, self.incremental_name)
+        if not self.may_exist('table'):
+            return self.create_table_stmt()
+        # Without a catalog, the table may still be missing, so it's created empty when it is
+        unknown = self.active_catalog() is None
+        return (f"""
+        CREATE SCHEMA IF NOT EXISTS {self.schema}
+        """ if unknown else None,
+        f"""
+        DROP TABLE IF EXISTS {self.incremental_name} CASCADE
+        """,
+        f"""
+        CREATE TABLE {self.incremental_name}
+        AS
+        {self.incremental_select_stmt()}
+        """,
+        self.create_missing_table_stmt() if unknown else None,
+        self.upsert_stmt(match),
+        f"""
+        DROP TABLE {self.incremental_name}
         """)
 
+    def create_missing_table_stmt(self) -> str:
+        """ Statement that creates the table, with the columns of the incremental table, if it doesn't exist
+        """
+        return f"""
+        CREATE TABLE IF NOT EXISTS {self.name} (LIKE {self.incremental_name})
+        """
+
+    def upsert_stmt(self, match: str) -> str:
+        """ Statement that replaces the rows of the table with the ones of the incremental table that have the same
+        unique keys, and adds the others
+        """
+        # Sent as one request, so that it runs as a single transaction
+        return f"""
+        DELETE FROM {self.name}
+        USING {self.incremental_name}
+        WHERE {match};
+        INSERT INTO {self.name}
+        SELECT * FROM {self.incremental_name};
+        """
+
     def run_check_stmt(self) -> Iterable[str]:
         return self.select_stmt(),
 
@@ -343,16 +640,286 @@ class Query(object):
         return ()
 
 
+class StatementScript:
+    """ Statements of a query, joined into one multi-statement script that can be sent in a single request.
+    Errors that point at a line of the script can be mapped back to the statement at that line.
+    """
+    def __init__(self, statements: Iterable[str]):
+        self.statements: List[str] = []
+        # Line of the script (1-based) where every statement starts
+        self.first_lines: List[int] = []
+        line = 1
+        for stmt in statements:
+            stmt = stmt.strip()
+            if stmt.strip(';').strip() == '':
+                continue
+            if not stmt.endswith(';'):
+                # On a separate line, in case the statement ends with a comment
+                stmt += '\n;'
+            self.statements.append(stmt)
+            self.first_lines.append(line)
+            line += stmt.count('\n') + 1
+        self.text: str = '\n'.join(self.statements)
+
+    def __len__(self) -> int:
+        return len(self.statements)
+
+    def statement_at(self, message: str, line_pattern: str) -> Union[str, None]:
+        """ The statement at the line that an error message points at, with the line number as first group of
+        `line_pattern`
+        """
+        match = re.search(line_pattern, message)
+        if not match:
+            return None
+        index = bisect_right(self.first_lines, int(match.group(1))) - 1
+        if index < 0:
+            return None
+        return self.statements[index]
+
+
+class RetryPolicy:
+    """ How often, and after how long, statements that failed with a transient error are retried. Configured with a
+    `retry` config entry:
+
+        "retry": {
+            "attempts": 3,
+            "base_delay": 1.0,
+            "max_delay": 60.0
+        }
+    """
+    def __init__(self, config: SimpleNamespace):
+        retry_config: Dict = getattr(config, 'retry', None) or {}
+        # Total number of attempts, including the first one
+        self.attempts: int = int(retry_config.get('attempts', 3))
+        self.base_delay: float = float(retry_config.get('base_delay', 1.0))
+        self.max_delay: float = float(retry_config.get('max_delay', 60.0))
+
+    def delay(self, attempt: int) -> float:
+        """ Exponential backoff with full jitter, in seconds, before retrying after attempt number `attempt`
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+class ConnectionPool:
+    """ Connections to one database, shared by the DB instances of the process, so that every worker, and every
+    later run in the same process, doesn't have to log in again. A connection belongs to one DB instance at a time.
+    Idle connections are health-checked before they're handed out again, broken ones are replaced, and all of them
+    are closed when the process exits. With `"max_connections": N`, DB instances wait for a free connection once
+    N are open.
+    """
+    pools: Dict[Tuple[type, str], "ConnectionPool"] = {}
+    pools_lock = threading.Lock()
+
+    def __init__(self, db_class: type, max_size: Union[int, None]):
+        self.db_class: type = db_class
+        self.max_size: Union[int, None] = max_size
+        self.condition = threading.Condition()
+        self.idle: List[Any] = []
+        # Open connections, idle or handed out, by id
+        self.connections: Dict[int, Any] = {}
+        # Open connections and ones being opened
+        self.size: int = 0
+
+    @staticmethod
+    def of(db: "DB") -> "ConnectionPool":
+        """ The pool of the database that a DB instance connects to
+        """
+        key = (type(db), json.dumps(getattr(db.config, 'auth', None), sort_keys=True, default=str))
+        with ConnectionPool.pools_lock:
+            if key not in ConnectionPool.pools:
+                ConnectionPool.pools[key] = ConnectionPool(type(db), getattr(db.config, 'max_connections', None))
+            return ConnectionPool.pools[key]
+
+    def acquire(self, db: "DB") -> Any:
+        """ A healthy connection, reused if one is idle
+        """
+        with self.condition:
+            while not self.idle and self.max_size and self.size >= self.max_size:
+                self.condition.wait()
+            connection = self.idle.pop() if self.idle else None
+            if connection is None:
+                self.size += 1
+        if connection is not None:
+            if self.db_class.is_healthy(connection):
+                return connection
+            self.forget(connection)
+        try:
+            connection = db.open_connection()
+        except Exception:
+            with self.condition:
+                self.size -= 1
+                self.condition.notify()
+            raise
+        with self.condition:
+            self.connections[id(connection)] = connection
+        return connection
+
+    def release(self, connection: Any, broken: bool = False):
+        """ Hand a connection back, or close it if it's broken
+        """
+        if broken:
+            self.forget(connection)
+        with self.condition:
+            if broken:
+                self.size -= 1
+            else:
+                self.idle.append(connection)
+            self.condition.notify()
+
+    def forget(self, connection: Any):
+        """ Close a connection that won't be used anymore
+        """
+        with self.condition:
+            self.connections.pop(id(connection), None)
+        try:
+            self.db_class.close_connection(connection)
+        except Exception:
+            pass
+
+    def close(self):
+        """ Close all connections, also the ones that are handed out, when nothing uses them anymore
+        """
+        with self.condition:
+            connections = list(self.connections.values())
+            self.connections, self.idle, self.size = {}, [], 0
+        for connection in connections:
+            try:
+                self.db_class.close_connection(connection)
+            except Exception:
+                pass
+
+    @staticmethod
+    def close_all():
+        with ConnectionPool.pools_lock:
+            pools = list(ConnectionPool.pools.values())
+        for pool in pools:
+            pool.close()
+
+
+atexit.register(ConnectionPool.close_all)
+
+
 class DB:
+    # Whether `execute_script` sends all statements in a single request
+    supports_scripts: bool = False
+    # Query that lists every schema and relation as (schema, relation or NULL, 'table' / 'view' or NULL)
+    catalog_stmt: Union[str, None] = None
+    # Whether validated statements report the bytes they would process, for `--estimate`
+    supports_estimates: bool = False
+
     def __init__(self, config: SimpleNamespace, cold_run: bool):
         self.cursor = None
+        self.config = config
         self.cold_run: bool = cold_run
+        self.retry_policy: RetryPolicy = RetryPolicy(config)
+        auth: Dict = getattr(config, 'auth', None) or {}
+        self.database: Union[str, None] = auth.get('database', auth.get('dbname'))
+        # Bytes that the last validated statement would process, where the DB reports it
+        self.estimated_bytes: Union[int, None] = None
+        # Connection from the pool, that the cursor belongs to
+        self.connection: Any = None
+
+    def connect(self):
+        """ (Re)open the connection
+        """
+        pass
+
+    def open_connection(self) -> Any:
+        """ New connection to the database, for the connection pool
+        """
+        raise Exception(f"`open_connection()` not implemented for type {type(self)}")
+
+    @staticmethod
+    def is_healthy(connection: Any) -> bool:
+        """ Whether an idle connection can still be used
+        """
+        return True
+
+    @staticmethod
+    def close_connection(connection: Any):
+        connection.close()
+
+    def acquire_connection(self) -> Any:
+        """ Take a connection from the pool. A connection that was taken before is assumed to be broken, since it's
+        being replaced
+        """
+        pool = ConnectionPool.of(self)
+        if self.connection is not None:
+            pool.release(self.connection, broken=True)
+            self.connection = None
+        self.connection = pool.acquire(self)
+        return self.connection
+
+    def close(self):
+        """ Hand the connection back to the pool
+        """
+        if self.connection is not None:
+            ConnectionPool.of(self).release(self.connection)
+            self.connection = None
+
+    def is_transient_error(self, error: Exception) -> bool:
+        """ Whether the statement can succeed when it's tried again
+        """
+        return False
+
+    def needs_reconnect(self, error: Exception) -> bool:
+        """ Whether the connection has to be opened again, before trying again
+        """
+        return False
+
+    def execute_with_retry(self, execute: Callable[[], Any], query: Query = None,
+                           repeatable: Callable[[Exception], bool] = None) -> Any:
+        """ Call `execute`, and call it again after transient errors, for statements that can safely be repeated.
+        `repeatable` can limit that to some of the errors
+        """
+        attempt = 0
+        while True:
+            try:
+                return execute()
+            except Exception as ex:
+                attempt += 1
+                if attempt >= self.retry_policy.attempts or query is None or not query.idempotent \
+                        or not self.is_transient_error(ex) or repeatable is not None and not repeatable(ex):
+                    raise
+                delay = self.retry_policy.delay(attempt)
+                sys.stderr.write(f"Transient error executing '{query.name}': {ex}\n"
+                                 f"Retrying in {delay:.1f}s ({attempt}/{self.retry_policy.attempts - 1})\n")
+                time.sleep(delay)
+                if self.needs_reconnect(ex):
+                    self.connect()
 
     def execute(self, stmt: str, query: Query = None):
         """Execute statement using DB-specific connector
         """
         raise Exception(f"`execute()` not implemented for type {type(self)}")
 
+    def load_catalog(self) -> Union[Catalog, None]:
+        """ Snapshot of the existing schemata and relations, loaded with one catalog query, if the DB supports it
+        """
+        if self.cold_run or self.catalog_stmt is None:
+            return None
+        self.execute(self.catalog_stmt)
+        return Catalog(self.database, self.fetchall())
+
+    def execute_script(self, script: StatementScript, query: Query = None):
+        """ Execute the statements of a script in a single request, where the DB-specific connector can do that
+        """
+        for stmt in script.statements:
+            self.execute(stmt, query)
+
+    def write_error(self, stmt: str, query: Query = None):
+        """ Write the failed statement, and the exception being handled, to stderr
+        """
+        if query:
+            msg = dedent(f'''
+                ERROR: executing '{query.name}':
+                SQL path "{query.path}"'''
+            )
+        else:
+            msg = "ERROR: executing query:\n\n"
+        msg += f"\n\n{stmt}\n\n{traceback.format_exc()}\n"
+        sys.stderr.write(msg)
+
     def clean_specific_schemas(self, schemata: Iterable[str]):
         """ Drop a specific list of schemata
         """
@@ -386,6 +953,69 @@ class DB:
             {values}"""
         self.execute(insert_stmt)
 
+    @staticmethod
+    def sql_literal(value) -> str:
+        """ Value as an SQL literal, for bulk inserts
+        """
+        if value is None:
+            return 'NULL'
+        if isinstance(value, (int, float)):
+            return repr(value)
+        value = str(value).replace("'", "''")
+        return f"'{value}'"
+
+    @property
+    def rowcount(self) -> Union[int, None]:
+        """ Number of rows affected or returned by the last statement, if known
+        """
+        if self.cold_run:
+            return None
+        rowcount = getattr(self.cursor, 'rowcount', None)
+        if rowcount is None or rowcount < 0:
+            return None
+        return rowcount
+
+    def save_run_history(self, monitor_schema: str, records: List[Tuple]):
+        """ Append the records of a run to the `run_history` table in the `monitor_schema` schema
+        """
+        self.execute(f'CREATE SCHEMA IF NOT EXISTS {monitor_schema};')
+        self.execute(f"""
+            CREATE TABLE IF NOT EXISTS {monitor_schema}.run_history
+            (
+            run_id           VARCHAR(64),
+            execution_type   VARCHAR(16),
+            schema_name      VARCHAR(256),
+            table_name       VARCHAR(256),
+            statement_index  INTEGER,
+            started_at       TIMESTAMP,
+            duration_seconds FLOAT,
+            row_count        BIGINT,
+            status           VARCHAR(16)
+            );"""
+        )
+        # Keep statements at a reasonable size
+        for i in range(0, len(records), 1000):
+            values = ',\n'.join(
+                '(' + ','.join(DB.sql_literal(value) for value in record) + ')'
+                for record in records[i:i + 1000]
+            )
+            self.execute(f"""
+            INSERT INTO {monitor_schema}.run_history
+            VALUES
+            {values}""")
+
+    def load_run_history(self, monitor_schema: str, execution_type: str) -> List[Tuple]:
+        """ Schema, table and duration of every successful node build, in chronological order
+        """
+        self.execute(f"""
+            SELECT schema_name, table_name, duration_seconds
+            FROM {monitor_schema}.run_history
+            WHERE statement_index IS NULL
+            AND   status = 'success'
+            AND   execution_type = '{execution_type}'
+            ORDER BY started_at""")
+        return self.fetchall()
+
     def fetchone(self):
         if self.cold_run:
             return None
@@ -4,9 +4,10 @@ import sys
 import re
 from types import SimpleNamespace
 from textwrap import dedent
-from typing import List, Dict, Iterable
+from collections import defaultdict
+from typing import List, Dict, Iterable, Tuple, Union, Set
 
-from sql_runner.db import Query, DB, FakeCursor
+from sql_runner.db import Query, DB, FakeCursor, ExecutionError
 
 
 class AzureDwhQuery(Query):
@@ -45,25 +46,113 @@ class AzureDwhQuery(Query):
         """ Statement that creates a table out of `select_stmt`
         """
         # https://docs.microsoft.com/en-us/sql/t-sql/statements/create-table-as-select-azure-sql-data-warehouse?view=azure-sqldw-latest
-        return (f"""
+        target = self.shadow_name() if self.swap_tables else self.name
+        statements = (f"""
         IF NOT {self.schema_exists_stmt(self.schema)}
             EXEC('CREATE SCHEMA {self.schema}')
-        """,
+        """ if self.schema_missing() else None,
+        f"""
+        IF {AzureDwhDB.object_exists_stmt(self.schema, self.shadow_relation, table=True)}
+            DROP TABLE {target}
+        """ if self.swap_tables else None,
         f"""
         IF {self.table_exists_stmt(self.schema)}
             DROP TABLE {self.name}
-        """,
+        """ if not self.swap_tables and self.may_exist('table') else None,
         f"""
         IF {self.view_exists_stmt(self.schema)}
             DROP VIEW {self.name}
-        """,
+        """ if not self.swap_tables and self.may_exist('view') else None,
         f"""
-        CREATE TABLE {self.name}
+        CREATE TABLE {target}
         WITH ( {self.distribution} )
         AS
         {self.select_stmt()}
         """
-        )
+        ) + self.swap_stmt()
+        self.record_relation('table')
+        return statements
+
+    def swap_stmt(self, mat: bool = False, then: Iterable[Union[str, None]] = ()) -> Tuple[Union[str, None], ...]:
+        """ Statements that replace the table (of the materialized view back-end) with the shadow table, followed by
+        `then`. Without `swap_tables`, only `then`
+        """
+        if not self.swap_tables:
+            return tuple(then)
+        schema, name = (self.schema_mat, self.name_mat) if mat else (self.schema, self.name)
+        relation = self.name_components.relation
+        previous = f'{self.shadow_relation}_old'
+        # Renaming only changes metadata, so the table is missing only for a moment
+        return (f"""
+        IF {AzureDwhDB.object_exists_stmt(schema, previous, table=True)}
+            DROP TABLE {schema}.{previous}
+        """,
+        f"""
+        IF {AzureDwhDB.object_exists_stmt(schema, relation, table=True)}
+            RENAME OBJECT {name} TO {previous}
+        """,
+        f"""
+        IF {AzureDwhDB.object_exists_stmt(schema, relation, view=True)}
+            DROP VIEW {name}
+        """ if self.may_exist('view', mat=mat) else None,
+        f"""
+        RENAME OBJECT {self.shadow_name(mat)} TO {relation}
+        """,
+        f"""
+        IF {AzureDwhDB.object_exists_stmt(schema, previous, table=True)}
+            DROP TABLE {schema}.{previous}
+        """) + tuple(then)
+
+    def merge_stmt(self) -> Iterable[str]:
+        """ Statement that creates a table out of `select_stmt` on its first build, and merges the new rows of
+        `incremental_select_stmt` by the unique keys after that
+        """
+        match = self.unique_keys_match(self.name, self.incremental_name)
+        if not self.may_exist('table'):
+            return self.create_table_stmt()
+        incremental_relation = self.name_components.relation + Query.incremental_suffix
+        # Without a catalog, the table may still be missing, so it's created empty when it is
+        unknown = self.active_catalog() is None
+        return (f"""
+        IF NOT {self.schema_exists_stmt(self.schema)}
+            EXEC('CREATE SCHEMA {self.schema}')
+        """ if unknown else None,
+        f"""
+        IF {AzureDwhDB.object_exists_stmt(self.schema, incremental_relation, table=True)}
+            DROP TABLE {self.incremental_name}
+        """,
+        f"""
+        CREATE TABLE {self.incremental_name}
+        WITH ( {self.distribution} )
+        AS
+        {self.incremental_select_stmt()}
+        """,
+        f"""
+        IF NOT {self.table_exists_stmt(self.schema)}
+            CREATE TABLE {self.name}
+            WITH ( {self.distribution} )
+            AS
+            SELECT * FROM {self.incremental_name} WHERE 1 = 0
+        """ if unknown else None,
+        self.upsert_stmt(match),
+        f"""
+        DROP TABLE {self.incremental_name}
+        """)
+
+    def upsert_stmt(self, match: str) -> str:
+        """ Statement that replaces the rows of the table with the ones of the incremental table that have the same
+        unique keys, and adds the others
+        """
+        # One batch, which is rolled back as a whole when any statement in it fails
+        return f"""
+        SET XACT_ABORT ON;
+        BEGIN TRANSACTION;
+        DELETE FROM {self.name}
+        WHERE EXISTS (SELECT 1 FROM {self.incremental_name} WHERE {match});
+        INSERT INTO {self.name}
+        SELECT * FROM {self.incremental_name};
+        COMMIT TRANSACTION;
+        """
 
     def create_mock_relation_stmt(self) -> Iterable[str]:
         """ Statement that creates a mock relation out of `select_stmt`
@@ -75,119 +164,186 @@ class AzureDwhQuery(Query):
     def create_view_stmt(self) -> Iterable[str]:
         """ Statement that creates a view out of `select_stmt`
         """
-        return (f"""
+        statements = (f"""
         IF NOT {self.schema_exists_stmt(self.schema)}
             EXEC('CREATE SCHEMA {self.schema}')
-        """,
+        """ if self.schema_missing() else None,
         f"""
         IF {self.view_exists_stmt(self.schema)}
             DROP VIEW {self.name}
-        """,
+        """ if self.may_exist('view') else None,
         f"""
         IF {self.table_exists_stmt(self.schema)}
             DROP TABLE {self.name}
-        """,
+        """ if self.may_exist('table') else None,
         f"""
         CREATE VIEW {self.name}
         AS
         {self.select_stmt()};
         """
         )
+        self.record_relation('view')
+        return statements
 
     def materialize_view_stmt(self) -> Iterable[str]:
         """ Statement that creates a materialized view, out of a `select_stmt`
         """
-        table_schema=f"{self.schema_prefix}{self.schema_name}{self.schema_suffix}"
-        view_schema=f"{self.schema_prefix}{self.schema_name}"
-
-        return (f"""
-        IF NOT {self.schema_exists_stmt(self.schema_mat)}
-            EXEC('CREATE SCHEMA {self.schema_mat}')
-        """,
-        f"""
-        IF {self.table_exists_stmt(self.schema_mat)}
-            DROP TABLE {self.name_mat}
-        """,
-        f"""
+        drop_view_stmts = (f"""
         IF {self.view_exists_stmt(self.schema)}
             DROP VIEW {self.name}
-        """,
+        """ if self.may_exist('view') else None,
         f"""
-        IF {self.table_exists_stmt(view_schema)}
+        IF {self.table_exists_stmt(self.schema)}
             DROP TABLE {self.name}
-        """,
+        """ if self.may_exist('table') else None)
+        create_view_stmt = f"""
+        CREATE VIEW {self.name}
+        AS
+        SELECT * FROM {self.name_mat}
+        """
+        target = self.shadow_name(mat=True) if self.swap_tables else self.name_mat
+        statements = (f"""
+        IF NOT {self.schema_exists_stmt(self.schema_mat)}
+            EXEC('CREATE SCHEMA {self.schema_mat}')
+        """ if self.schema_missing(mat=True) else None,
+        f"""
+        IF {AzureDwhDB.object_exists_stmt(self.schema_mat, self.shadow_relation, table=True)}
+            DROP TABLE {target}
+        """ if self.swap_tables else None,
         f"""
-        CREATE TABLE {self.name_mat}
+        IF {self.table_exists_stmt(self.schema_mat)}
+            DROP TABLE {self.name_mat}
+        """ if not self.swap_tables and self.may_exist('table', mat=True) else None)
+        # When swapping, the view keeps showing the previous table while the new one is built
+        if not self.swap_tables:
+            statements += drop_view_stmts
+        statements += (f"""
+        CREATE TABLE {target}
         WITH (
             {self.distribution}
         )
         AS
         {self.select_stmt()}
-        """,
-        f"""
-        IF {self.view_exists_stmt(self.schema)}
-            DROP VIEW {self.name}
-        """,
-        f"""
-        CREATE VIEW {self.name}
-        AS
-        SELECT * FROM {self.name_mat}
-        """)
+        """,)
+        if self.swap_tables:
+            statements += self.swap_stmt(mat=True, then=drop_view_stmts + (create_view_stmt,))
+        else:
+            statements += (create_view_stmt,)
+        self.record_relation('table', mat=True)
+        self.record_relation('view')
+        return statements
 
 
 class AzureDwhDB(DB):
+    catalog_stmt = """
+        SELECT s.name, o.name, CASE o.type WHEN 'V' THEN 'view' WHEN 'U' THEN 'table' END
+        FROM sys.schemas s
+        LEFT JOIN sys.objects o ON o.schema_id = s.schema_id AND o.type IN ('U', 'V')"""
+    # SQLSTATEs of lost connections
+    reconnect_sqlstates = {'08S01', '08001', '08003', '08004', '08007'}
+    # SQLSTATEs of deadlocks and timeouts
+    transient_sqlstates = {'40001', 'HYT00', 'HYT01'}
+
     def __init__(self, config, cold_run: bool):
         super().__init__(config, cold_run)
+        self.config = config
+        self.connect()
 
-        if cold_run:
+    def connect(self):
+        """ (Re)open the connection
+        """
+        if self.cold_run:
             self.cursor = FakeCursor()
         else:
-            conn = pyodbc.connect(
-                'DRIVER={{ODBC Driver 17 for SQL Server}};SERVER=tcp:{server};DATABASE={database};UID={username};PWD={password}'.format(
-                        **config.auth
-                    )
+            self.cursor = self.acquire_connection().cursor()
+
+    def open_connection(self):
+        conn = pyodbc.connect(
+            'DRIVER={{ODBC Driver 17 for SQL Server}};SERVER=tcp:{server};DATABASE={database};UID={username};PWD={password}'.format(
+                    **self.config.auth
                 )
-            conn.autocommit = True
-            self.cursor = conn.cursor()
+            )
+        conn.autocommit = True
+        return conn
 
-    def drop_object_cascade(self, type_desc: str, schema_name: str, object_name: str, object_id: int):
-        self.execute(f"""
-        SELECT
-            obj.type_desc,
-            s.name AS schema_name,
-            obj.name AS object_name,
-            obj.object_id
-        FROM sys.sql_expression_dependencies dep
-        JOIN sys.all_objects obj ON obj.object_id=dep.referencing_id
-        JOIN sys.schemas s ON s.schema_id = obj.schema_id
-        WHERE referenced_id = {object_id}
-        """)
+    @staticmethod
+    def is_healthy(connection) -> bool:
+        # pyodbc doesn't know whether the server closed the connection, before using it
+        try:
+            connection.cursor().execute('SELECT 1').fetchall()
+            return True
+        except pyodbc.Error:
+            return False
 
-        for obj in self.cursor.fetchall():
-            self.drop_object_cascade(*obj)
+    @staticmethod
+    def sqlstate(error: Exception) -> Union[str, None]:
+        if isinstance(error, pyodbc.Error) and error.args:
+            return error.args[0]
+        return None
 
-        if type_desc == 'USER_TABLE':
-            type_desc = 'TABLE'
-        
-        self.execute(f"""
-        IF OBJECT_ID('{schema_name}.{object_name}') IS NOT NULL
-            DROP {type_desc} {schema_name}.{object_name}
-        """)
+    def is_transient_error(self, error: Exception) -> bool:
+        """ Lost connections, deadlocks and timeouts
+        """
+        return self.needs_reconnect(error) or AzureDwhDB.sqlstate(error) in AzureDwhDB.transient_sqlstates
 
-    def drop_schema_cascade(self, schema: str):
-        self.execute(f"""
-        SELECT obj.type_desc, s.name AS schema_name, obj.name AS object_name, obj.object_id
+    def needs_reconnect(self, error: Exception) -> bool:
+        return AzureDwhDB.sqlstate(error) in AzureDwhDB.reconnect_sqlstates
+
+    def drop_schemata_cascade(self, schemata: Iterable[str]):
+        """ Drop schemata with everything in them, and everything that depends on that. Objects and their dependencies
+        are loaded with one query each, instead of one query per object
+        """
+        # Schema names are case-insensitive
+        schemata = {schema.lower() for schema in schemata}
+        if not schemata:
+            return
+        self.execute("""
+        SELECT obj.object_id, obj.type_desc, s.name AS schema_name, obj.name AS object_name
         FROM sys.all_objects obj
         JOIN sys.schemas s ON s.schema_id = obj.schema_id
-        WHERE s.name='{schema}'
+        WHERE obj.is_ms_shipped = 0
         """)
+        objects: Dict[int, Tuple[str, str, str]] = {
+            object_id: (type_desc, schema_name, object_name)
+            for object_id, type_desc, schema_name, object_name in self.cursor.fetchall()
+        }
+        self.execute("""
+        SELECT referenced_id, referencing_id
+        FROM sys.sql_expression_dependencies
+        WHERE referenced_id IS NOT NULL
+        """)
+        referencing: Dict[int, List[int]] = defaultdict(list)
+        for referenced_id, referencing_id in self.cursor.fetchall():
+            if referencing_id in objects:
+                referencing[referenced_id].append(referencing_id)
+
+        dropped: Set[int] = set()
+
+        def drop_object_cascade(object_id: int):
+            if object_id in dropped:
+                return
+            dropped.add(object_id)
+            for referencing_id in referencing[object_id]:
+                drop_object_cascade(referencing_id)
+            type_desc, schema_name, object_name = objects[object_id]
+            if type_desc == 'USER_TABLE':
+                type_desc = 'TABLE'
+            self.execute(f"""
+            IF OBJECT_ID('{schema_name}.{object_name}') IS NOT NULL
+                DROP {type_desc} {schema_name}.{object_name}
+            """)
+
+        for object_id, (_, schema_name, _) in objects.items():
+            if schema_name.lower() in schemata:
+                drop_object_cascade(object_id)
+
+        self.execute("SELECT name FROM sys.schemas")
+        for (schema_name,) in self.cursor.fetchall():
+            if schema_name.lower() in schemata:
+                self.execute(f"DROP SCHEMA {schema_name}")
 
-        for obj in self.cursor.fetchall():
-            self.drop_object_cascade(*obj)
-
-        self.execute(f"SELECT 1 FROM sys.schemas WHERE name='{schema}'")
-        if self.cursor.fetchone():
-            self.execute(f"DROP SCHEMA {schema}")
+    def drop_schema_cascade(self, schema: str):
+        self.drop_schemata_cascade([schema])
 
     def drop_schema_cascade_replacement(self, stmt: str) -> str:
         """ If the statement has `DROP SCHEMA x CASCADE`, do this in Python and remove the statement
@@ -222,8 +378,7 @@ class AzureDwhDB(DB):
     def clean_specific_schemas(self, schemata: List[str]):
         """ Drop a specific list of schemata
         """
-        for schema in schemata:
-            self.drop_schema_cascade(schema)
+        self.drop_schemata_cascade(schemata)
 
     def clean_schemas(self, prefix: str):
         """ Drop schemata that have a specific name prefix
@@ -238,8 +393,7 @@ class AzureDwhDB(DB):
             AND name LIKE '%_mat'"""
 
         self.execute(cmd)
-        for schema_name in self.cursor.fetchall():
-            self.drop_schema_cascade(schema_name[0])
+        self.drop_schemata_cascade(schema_name[0] for schema_name in self.cursor.fetchall())
 
     def save(self, monitor_schema: str, dependencies: List[Dict]):
         """ Save dependencies list in the database in the `monitor_schema` schema
@@ -268,12 +422,44 @@ class AzureDwhDB(DB):
 
         self.execute(inserts)
 
+    def save_run_history(self, monitor_schema: str, records: List[Tuple]):
+        """ Append the records of a run to the `run_history` table in the `monitor_schema` schema
+        """
+        self.execute(f"""
+        IF NOT {AzureDwhDB.object_exists_stmt(monitor_schema)}
+            EXEC('CREATE SCHEMA {monitor_schema}');""")
+
+        self.execute(f"""
+            IF NOT {AzureDwhDB.object_exists_stmt(monitor_schema, 'run_history', table=True)}
+                CREATE TABLE {monitor_schema}.run_history
+                (
+                run_id           NVARCHAR(64),
+                execution_type   NVARCHAR(16),
+                schema_name      NVARCHAR(2000),
+                table_name       NVARCHAR(2000),
+                statement_index  INT,
+                started_at       DATETIME2,
+                duration_seconds FLOAT,
+                row_count        BIGINT,
+                status           NVARCHAR(16)
+                );"""
+        )
+
+        # Multi-row VALUES aren't supported, so every row is a separate INSERT in one batch
+        for i in range(0, len(records), 1000):
+            inserts = '\n'.join(
+                f"INSERT INTO {monitor_schema}.run_history VALUES "
+                f"({','.join(DB.sql_literal(value) for value in record)});"
+                for record in records[i:i + 1000]
+            )
+            self.execute(inserts)
+
     def execute(self, stmt: str, query: AzureDwhQuery = None):
         """Execute statement using DB-specific connector
         """
         try:
             stmt = self.drop_schema_cascade_replacement(stmt)
-            self.cursor.execute(stmt)
+            self.execute_with_retry(lambda: self.cursor.execute(stmt), query)
         except (pyodbc.Error, pyodbc.ProgrammingError) as ex:
             msg = ""
             if query:
@@ -286,4 +472,4 @@ class AzureDwhDB(DB):
             
             msg += f"{dedent(stmt)}\n\n{ex.args[1]}\n{''.join(traceback.format_stack(limit=3)[:-1])}\n"
             sys.stderr.write(msg)
-            exit(1)
+            raise ExecutionError(f"Error executing statement for {query.name if query else 'query'}") from ex
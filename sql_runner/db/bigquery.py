@@ -7,9 +7,9 @@ from types import SimpleNamespace
 from google.cloud import bigquery
 from google.api_core import exceptions
 from google.cloud.bigquery.job import QueryJob
-from sql_runner.db import Query, DB, FakeCursor
+from sql_runner.db import Query, DB, FakeCursor, ExecutionError, StatementScript
 from sql_runner import ExecutionType
-from typing import List, Dict, Iterable, Set, Tuple
+from typing import List, Dict, Iterable, Set, Tuple, Union
 
 '''
   ▄████  ▒█████   ▒█████    ▄████  ██▓    ▓█████     ▄▄▄▄    ██▓  ▄████   █████   █    ██ ▓█████  ██▀███ ▓██   ██▓
@@ -29,9 +29,9 @@ class FakeClient:
     def __init__(self):
         self.fake_cursor = FakeCursor()
 
-    def query(self, statement):
+    def query(self, statement, job_config=None):
         self.fake_cursor.execute(statement)
-        return SimpleNamespace(result=lambda: iter([]))
+        return SimpleNamespace(result=lambda: iter([]), total_bytes_processed=0)
 
     def delete_dataset(self, schema):
         pass
@@ -47,6 +47,15 @@ class BigQueryQuery(Query):
         super().__init__(config, args, all_created_entities, execution_type, schema_name, table_name, action)
         self.database = config.auth["database"]
 
+    @property
+    def maximum_bytes_billed(self) -> Union[int, None]:
+        """ Limit of the bytes billed by the jobs of the query, which fail without being charged above it. From the
+        `"maximum_bytes_billed"` functional comment or config
+        """
+        maximum_bytes_billed = self.functional_comment('maximum_bytes_billed',
+                                                       getattr(self.config, 'maximum_bytes_billed', None))
+        return int(maximum_bytes_billed) if maximum_bytes_billed else None
+
     @property
     def partition_by_stmt(self) -> str:
         """ Partition key statement, parsed out of `PARTITION BY <field>`.
@@ -79,12 +88,86 @@ class BigQueryQuery(Query):
         {self.select_stmt()}
         """)
 
+    def clone_stmt(self) -> Union[Iterable[str], None]:
+        """ Statements that create the relation as a zero-copy clone of its production version, for clone staging
+        """
+        if self.schema == self.production_schema():
+            # Excepted from staging names, so it's the production relation itself
+            return ()
+        # Only tables can be cloned. Views are cheap to build anyway
+        relation = self.name_components.relation
+        if self.action in {'t', 'i'}:
+            return (f"""
+            CREATE SCHEMA IF NOT EXISTS `{self.schema}`
+            """,
+            f"""
+            CREATE OR REPLACE TABLE `{self.name}`
+            CLONE `{self.production_schema()}.{relation}`
+            """)
+        if self.action == 'm':
+            return (f"""
+            CREATE SCHEMA IF NOT EXISTS `{self.schema_mat}`
+            """,
+            f"""
+            CREATE OR REPLACE TABLE `{self.name_mat}`
+            CLONE `{self.production_schema(mat=True)}.{relation}`
+            """,
+            f"""
+            CREATE SCHEMA IF NOT EXISTS `{self.schema}`
+            """,
+            f"""
+            CREATE OR REPLACE VIEW `{self.name}`
+            AS
+            SELECT * FROM `{self.name_mat}`
+            """)
+        return None
+
+    def merge_stmt(self) -> Iterable[str]:
+        """ Statement that creates a table out of `select_stmt` on its first build, and merges the new rows of
+        `incremental_select_stmt` by the unique keys after that
+        """
+        # Whether the table exists is checked by the script itself, since there's no catalog snapshot for BigQuery.
+        # Temporary tables only live as long as the script, so nothing is left behind when it fails
+        relation = self.name_components.relation
+        incremental_relation = relation + Query.incremental_suffix
+        match = self.unique_keys_match('merge_target', incremental_relation)
+        # Rendered once for both branches, since names are preprocessed in place
+        select_stmt = self.select_stmt()
+        return (f"""
+        CREATE SCHEMA IF NOT EXISTS `{self.schema}`
+        """,
+        f"""
+        IF NOT EXISTS (
+            SELECT 1 FROM `{self.schema}`.INFORMATION_SCHEMA.TABLES WHERE table_name = '{relation}'
+        ) THEN
+            CREATE TABLE `{self.name}` {self.partition_by_stmt} {self.options_stmt}
+            AS
+            {select_stmt};
+        ELSE
+            CREATE TEMP TABLE {incremental_relation}
+            AS
+            {self.incremental_select_stmt(select_stmt)};
+            BEGIN TRANSACTION;
+            DELETE FROM `{self.name}` merge_target
+            WHERE EXISTS (SELECT 1 FROM {incremental_relation} WHERE {match});
+            INSERT INTO `{self.name}`
+            SELECT * FROM {incremental_relation};
+            COMMIT TRANSACTION;
+        END IF;
+        """)
+
     def create_mock_relation_stmt(self) -> Iterable[str]:
         """ Statement that creates a mock relation out of `select_stmt`
         """
         # BigQuery charges per table scan, regardless of LIMIT clause. Cost-wise it makes more sense to make it a view
         return self.create_view_stmt()
 
+    def explain_stmt(self) -> Iterable[str]:
+        """ Statement that validates `select_stmt` against the existing sources, without creating anything. It's
+        executed as a dry run
+        """
+        return self.select_stmt(),
+
     def create_view_stmt(self) -> Iterable[str]:
         """ Statement that creates a view out of `select_stmt`
         """
@@ -109,16 +192,26 @@ class BigQueryQuery(Query):
         {self.select_stmt()}
         """,
         f"""
-        DROP VIEW IF EXISTS `{self.name}`
-        """,
-        f"""
-        CREATE VIEW `{self.name}`
+        CREATE OR REPLACE VIEW `{self.name}`
         AS
         SELECT * FROM `{self.name_mat}`;
         """)
 
 
 class BigQueryDB(DB):
+    supports_scripts = True
+    supports_estimates = True
+
+    # Server-side errors and rate limits that go away when trying again later
+    transient_exceptions = (
+        exceptions.TooManyRequests,
+        exceptions.InternalServerError,
+        exceptions.BadGateway,
+        exceptions.ServiceUnavailable,
+        exceptions.GatewayTimeout,
+    )
+    transient_error_reasons = {'rateLimitExceeded', 'jobRateLimitExceeded', 'backendError', 'internalError'}
+
     def __init__(self, config: SimpleNamespace, cold_run: bool):
         super().__init__(config, cold_run)
         if 'credentials_path' in config.auth:
@@ -126,11 +219,31 @@ class BigQueryDB(DB):
             os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = credentials_path
 
         self.database = config.auth["database"]
-        if cold_run:
+        self.connect()
+        self.result = None
+
+    def connect(self):
+        """ (Re)create the client
+        """
+        if self.cold_run:
             self.client = FakeClient()
         else:
-            self.client = bigquery.Client(project=self.database)
-        self.result = None
+            self.client = self.acquire_connection()
+
+    def open_connection(self):
+        return bigquery.Client(project=self.database)
+
+    def is_transient_error(self, error: Exception) -> bool:
+        """ Server errors and rate limits, also when they're reported as `403 rateLimitExceeded`
+        """
+        if isinstance(error, BigQueryDB.transient_exceptions) or isinstance(error, ConnectionError):
+            return True
+        return isinstance(error, exceptions.GoogleAPICallError) and any(
+            e.get('reason') in BigQueryDB.transient_error_reasons for e in (error.errors or ())
+        )
+
+    def needs_reconnect(self, error: Exception) -> bool:
+        return isinstance(error, ConnectionError)
 
     def create_schema(self, schema: str):
         self.client.create_dataset(schema)
@@ -175,6 +288,19 @@ class BigQueryDB(DB):
             flags=re.IGNORECASE | re.DOTALL
         )
 
+    def run_job(self, stmt: str, query: BigQueryQuery = None):
+        """ Run a query job, and return its result. Queries that are validated get a dry run, which only checks them
+        """
+        if query is not None and query.action == 'explain':
+            job = self.client.query(stmt, job_config=bigquery.QueryJobConfig(dry_run=True, use_query_cache=False))
+            self.estimated_bytes = job.total_bytes_processed or 0
+            print(f'Valid, would process {self.estimated_bytes:,} bytes')
+            return iter([])
+        if query is not None and query.maximum_bytes_billed:
+            job_config = bigquery.QueryJobConfig(maximum_bytes_billed=query.maximum_bytes_billed)
+            return self.client.query(stmt, job_config=job_config).result()
+        return self.client.query(stmt).result()
+
     def execute(self, stmt: str, query: BigQueryQuery = None):
         """Execute statement using DB-specific connector
         """
@@ -183,7 +309,7 @@ class BigQueryDB(DB):
         if stmt.strip().strip(';') == '':
             return
         try:
-            self.result: QueryJob = self.client.query(stmt).result()
+            self.result: QueryJob = self.execute_with_retry(lambda: self.run_job(stmt, query), query)
         except Exception:
             msg = ""
             if query:
@@ -195,7 +321,22 @@ class BigQueryDB(DB):
                 msg = "ERROR: executing query:\n\n"
             msg += f"\n\n{stmt}\n\n{traceback.format_exc()}\n"
             sys.stderr.write(msg)
-            exit(1)
+            raise ExecutionError(f"Error executing statement for {query.name if query else 'query'}")
+
+    def execute_script(self, script: StatementScript, query: BigQueryQuery = None):
+        """ Execute all statements as a single script job. Schemata are still created and dropped through the API
+        """
+        script = StatementScript(
+            self.create_schema_replacement(self.drop_schema_replacement(stmt)) for stmt in script.statements
+        )
+        if not len(script):
+            return
+        try:
+            self.result: QueryJob = self.execute_with_retry(lambda: self.run_job(script.text, query), query)
+        except Exception as ex:
+            # Error locations look like `at [line:column]`, relative to the script
+            self.write_error(script.statement_at(str(ex), r'at \[(\d+):\d+\]') or script.text, query)
+            raise ExecutionError(f"Error executing statement for {query.name if query else 'query'}")
 
     def clean_specific_schemas(self, schemata: List[str]):
         """ Drop a specific list of schemata
@@ -223,3 +364,10 @@ class BigQueryDB(DB):
 
     def save(self, monitor_schema: str, dependencies: List[Dict]):
         print("Saving dependencies is not supported on BigQuery")
+
+    def save_run_history(self, monitor_schema: str, records: List[Tuple]):
+        print("Saving run history is not supported on BigQuery")
+
+    def load_run_history(self, monitor_schema: str, execution_type: str) -> List[Tuple]:
+        print("Run history is not supported on BigQuery")
+        return []
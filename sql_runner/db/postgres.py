@@ -4,7 +4,7 @@ import sys
 from types import SimpleNamespace
 from typing import List
 from textwrap import dedent
-from sql_runner.db import Query, DB, FakeCursor
+from sql_runner.db import Query, DB, FakeCursor, ExecutionError, StatementScript
 
 
 class PostgresQuery(Query):
@@ -12,21 +12,53 @@ class PostgresQuery(Query):
 
 
 class PostgresDB(DB):
+    supports_scripts = True
+    # Also lists relations that information_schema hides for lack of privileges
+    catalog_stmt = """
+        SELECT n.nspname, c.relname, CASE WHEN c.relkind = 'v' THEN 'view' WHEN c.relkind IS NOT NULL THEN 'table' END
+        FROM pg_catalog.pg_namespace n
+        LEFT JOIN pg_catalog.pg_class c ON c.relnamespace = n.oid AND c.relkind IN ('r', 'v', 'm', 'p', 'f')"""
+
+    # serialization_failure, deadlock_detected
+    transient_error_codes = {'40001', '40P01'}
+
     def __init__(self, config: SimpleNamespace, cold_run: bool):
         super().__init__(config, cold_run)
-        if cold_run:
+        self.config = config
+        self.connect()
+
+    def connect(self):
+        """ (Re)open the connection
+        """
+        if self.cold_run:
             self.cursor = FakeCursor()
         else:
-            connection = psycopg2.connect(**config.auth, connect_timeout=3)
-            connection.autocommit = True
-            self.cursor = connection.cursor()
+            self.cursor = self.acquire_connection().cursor()
+
+    def open_connection(self):
+        connection = psycopg2.connect(**self.config.auth, connect_timeout=3)
+        connection.autocommit = True
+        return connection
+
+    @staticmethod
+    def is_healthy(connection) -> bool:
+        return not connection.closed
+
+    def is_transient_error(self, error: Exception) -> bool:
+        """ Dropped connections, serialization failures and deadlocks
+        """
+        return self.needs_reconnect(error) or getattr(error, 'pgcode', None) in PostgresDB.transient_error_codes
+
+    def needs_reconnect(self, error: Exception) -> bool:
+        return isinstance(error, psycopg2.InterfaceError) \
+            or isinstance(error, psycopg2.OperationalError) and getattr(error, 'pgcode', None) is None
 
     def execute(self, stmt: str, query: PostgresQuery = None):
         """Execute statement using DB-specific connector
         """
         try:
-            self.cursor.execute(stmt)
-        except (psycopg2.ProgrammingError, psycopg2.InternalError):
+            self.execute_with_retry(lambda: self.cursor.execute(stmt), query)
+        except psycopg2.Error:
             msg = ""
             if query:
                 msg = dedent(f'''
@@ -37,7 +69,16 @@ class PostgresDB(DB):
                 msg = "ERROR: executing query:\n\n"
             msg += f"\n\n{stmt}\n\n{traceback.format_exc()}\n"
             sys.stderr.write(msg)
-            exit(1)
+            raise ExecutionError(f"Error executing statement for {query.name if query else 'query'}")
+
+    def execute_script(self, script: StatementScript, query: PostgresQuery = None):
+        """ Execute all statements in a single request. Positions in errors are relative to the whole script
+        """
+        try:
+            self.execute_with_retry(lambda: self.cursor.execute(script.text), query)
+        except psycopg2.Error as ex:
+            self.write_error(script.statement_at(str(ex), r'(?m)^LINE (\d+):') or script.text, query)
+            raise ExecutionError(f"Error executing statement for {query.name if query else 'query'}")
 
     def clean_specific_schemas(self, schemata: List[str]):
         """ Drop a specific list of schemata
@@ -37,20 +37,23 @@ class RedshiftQuery(PostgresQuery):
     def create_table_stmt(self) -> Iterable[str]:
         """ Statement that creates a table out of `select_stmt`
         """
-        return (f"""
+        target = self.shadow_name() if self.swap_tables else self.name
+        statements = (f"""
         CREATE SCHEMA IF NOT EXISTS {self.schema}
-        """,
+        """ if self.schema_missing() else None,
         f"""
-        DROP TABLE IF EXISTS {self.name} CASCADE
-        """,
+        DROP TABLE IF EXISTS {target} CASCADE
+        """ if self.swap_tables or self.may_exist() else None,
         f"""
-        CREATE TABLE {self.name} {self.distkey_stmt} {self.sortkey_stmt}
+        CREATE TABLE {target} {self.distkey_stmt} {self.sortkey_stmt}
         AS
         {self.select_stmt()}
         """,
         f"""
-        ANALYZE {self.name}
-        """)
+        ANALYZE {target}
+        """) + self.swap_stmt()
+        self.record_relation('table')
+        return statements
 
     def create_mock_relation_stmt(self) -> Iterable[str]:
         """ Statement that creates a mock relation out of `select_stmt`
@@ -61,31 +64,34 @@ class RedshiftQuery(PostgresQuery):
     def materialize_view_stmt(self) -> Iterable[str]:
         """ Statement that creates a "materialized" view, or equivalent, out of a `select_stmt`
         """
-        return (f"""
+        target = self.shadow_name(mat=True) if self.swap_tables else self.name_mat
+        statements = (f"""
         CREATE SCHEMA IF NOT EXISTS {self.schema_mat}
-        """,
+        """ if self.schema_missing(mat=True) else None,
         f"""
-        DROP TABLE IF EXISTS {self.name_mat} CASCADE
-        """,
+        DROP TABLE IF EXISTS {target} CASCADE
+        """ if self.swap_tables or self.may_exist(mat=True) else None,
         f"""
-        CREATE TABLE {self.name_mat} {self.distkey_stmt} {self.sortkey_stmt}
+        CREATE TABLE {target} {self.distkey_stmt} {self.sortkey_stmt}
         AS
         {self.select_stmt()}
         """,
         f"""
-        ANALYZE {self.name_mat}
+        ANALYZE {target}
         """,
         f"""
         CREATE SCHEMA IF NOT EXISTS {self.schema}
-        """,
-        f"""
+        """ if self.schema_missing() else None) + self.swap_stmt(mat=True, then=(f"""
         DROP VIEW IF EXISTS {self.name} CASCADE
-        """,
+        """ if self.may_exist() else None,
         f"""
         CREATE VIEW {self.name}
         AS
         SELECT * FROM {self.name_mat}
-        """)
+        """))
+        self.record_relation('table', mat=True)
+        self.record_relation('view')
+        return statements
 
 
 class RedshiftDB(PostgresDB):
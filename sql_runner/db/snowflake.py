@@ -1,11 +1,12 @@
+import re
 import snowflake.connector
 import traceback
 import sys
 from types import SimpleNamespace
-from typing import List, Iterable
+from typing import List, Iterable, Tuple, Union
 from textwrap import dedent
 
-from sql_runner.db import Query, DB, FakeCursor
+from sql_runner.db import Query, DB, FakeCursor, ExecutionError, StatementScript
 
 
 class SnowflakeQuery(Query):
@@ -17,23 +18,122 @@ class SnowflakeQuery(Query):
         # This has to be views
         return self.create_view_stmt()
 
+    def clone_stmt(self) -> Iterable[str]:
+        """ Statements that create the relation as a zero-copy clone of its production version, for clone staging
+        """
+        # Whole schemata are cloned, since views can't be cloned on their own. Relations of changed queries are
+        # built afterwards, over the clones
+        schemata = [(self.schema, self.production_schema())]
+        if self.action == 'm':
+            schemata.append((self.schema_mat, self.production_schema(mat=True)))
+        return tuple(f"""
+        CREATE OR REPLACE SCHEMA {staging} CLONE {production}
+        """ for staging, production in schemata if staging != production)
+
+    def create_missing_table_stmt(self) -> str:
+        """ Statement that creates the table, with the columns of the incremental table, if it doesn't exist
+        """
+        return f"""
+        CREATE TABLE IF NOT EXISTS {self.name} LIKE {self.incremental_name}
+        """
+
+    def upsert_stmt(self, match: str) -> str:
+        """ Statement that replaces the rows of the table with the ones of the incremental table that have the same
+        unique keys, and adds the others
+        """
+        # A single anonymous block, so that it's one statement, and rolled back when it fails
+        return f"""
+        EXECUTE IMMEDIATE $$
+        BEGIN
+            BEGIN TRANSACTION;
+            DELETE FROM {self.name}
+            USING {self.incremental_name}
+            WHERE {match};
+            INSERT INTO {self.name}
+            SELECT * FROM {self.incremental_name};
+            COMMIT;
+        EXCEPTION
+            WHEN OTHER THEN
+                ROLLBACK;
+                RAISE;
+        END;
+        $$
+        """
+
+    def swap_stmt(self, mat: bool = False, then: Iterable[Union[str, None]] = ()) -> Tuple[Union[str, None], ...]:
+        """ Statements that replace the table (of the materialized view back-end) with the shadow table, followed by
+        `then`. Without `swap_tables`, only `then`
+        """
+        if not self.swap_tables:
+            return tuple(then)
+        name = self.name_mat if mat else self.name
+        return (f"""
+        CREATE TABLE IF NOT EXISTS {name} LIKE {self.shadow_name(mat)}
+        """,
+        # Swapping is atomic, and views keep referencing the table by name
+        f"""
+        ALTER TABLE {name} SWAP WITH {self.shadow_name(mat)}
+        """,
+        f"""
+        DROP TABLE {self.shadow_name(mat)}
+        """) + tuple(then)
+
 
 class SnowflakeDB(DB):
+    supports_scripts = True
+    catalog_stmt = """
+        SELECT schema_name, NULL, NULL
+        FROM information_schema.schemata
+        UNION ALL
+        SELECT table_schema, table_name, CASE WHEN table_type = 'VIEW' THEN 'view' ELSE 'table' END
+        FROM information_schema.tables"""
+
+    # Authentication token / session expired
+    reconnect_error_codes = {390111, 390112, 390114}
+    # Messages of errors that go away on their own, like a warehouse that's resuming, or too many lock waiters
+    transient_error_pattern = re.compile(r'warehouse.*(resum|suspend)|waiters for this lock|'
+                                         r'service is unavailable|try again', re.IGNORECASE | re.DOTALL)
+
     def __init__(self, config: SimpleNamespace, cold_run: bool):
         super().__init__(config, cold_run)
-        if cold_run:
+        self.config = config
+        self.connect()
+
+    def connect(self):
+        """ (Re)open the connection
+        """
+        if self.cold_run:
             self.cursor = FakeCursor()
         else:
-            connection = snowflake.connector.connect(**config.auth)
-            self.cursor = connection.cursor()
-        self.cursor.execute(f'USE DATABASE {config.auth["database"]}')
+            self.cursor = self.acquire_connection().cursor()
+        # Pooled connections can come from a session that used another database
+        self.cursor.execute(f'USE DATABASE {self.config.auth["database"]}')
+
+    def open_connection(self):
+        return snowflake.connector.connect(**self.config.auth)
+
+    @staticmethod
+    def is_healthy(connection) -> bool:
+        return not connection.is_closed()
+
+    def is_transient_error(self, error: Exception) -> bool:
+        """ Network errors, expired sessions, resuming warehouses and lock contention
+        """
+        return self.needs_reconnect(error) \
+            or isinstance(error, snowflake.connector.errors.Error) \
+            and SnowflakeDB.transient_error_pattern.search(str(error)) is not None
+
+    def needs_reconnect(self, error: Exception) -> bool:
+        return isinstance(error, (snowflake.connector.errors.OperationalError,
+                                  snowflake.connector.errors.InterfaceError)) \
+            or getattr(error, 'errno', None) in SnowflakeDB.reconnect_error_codes
 
     def execute(self, stmt: str, query: SnowflakeQuery = None):
         """Execute statement using DB-specific connector
         """
         try:
-            self.cursor.execute(stmt)
-        except snowflake.connector.errors.ProgrammingError:
+            self.execute_with_retry(lambda: self.cursor.execute(stmt), query)
+        except snowflake.connector.errors.Error:
             msg = ""
             if query:
                 msg = dedent(f'''
@@ -44,7 +144,40 @@ class SnowflakeDB(DB):
                 msg = "ERROR: executing query:\n\n"
             msg += f"\n\n{stmt}\n\n{traceback.format_exc()}\n"
             sys.stderr.write(msg)
-            exit(1)
+            raise ExecutionError(f"Error executing statement for {query.name if query else 'query'}")
+
+    def execute_script(self, script: StatementScript, query: SnowflakeQuery = None):
+        """ Execute all statements in a single multi-statement request. The statements before the failed one already
+        ran, so they're not repeated. The failed statement is looked up in the query history instead. The script is
+        only retried when it failed before Snowflake accepted it, and none of its statements ran
+        """
+        try:
+            self.execute_with_retry(lambda: self.cursor.execute(script.text, num_statements=len(script)), query,
+                                    repeatable=lambda ex: getattr(ex, 'sfqid', None) is None)
+        except snowflake.connector.errors.Error as ex:
+            self.write_error(self.failed_statement(script, ex) or script.text, query)
+            raise ExecutionError(f"Error executing statement for {query.name if query else 'query'}")
+
+    def failed_statement(self, script: StatementScript, error: Exception) -> Union[str, None]:
+        """ The statement of a script that failed. Errors only point at a line of that statement, so it's the latest
+        failed query of the session that's one of the statements of the script
+        """
+        statements = {' '.join(stmt.split()).rstrip(';').strip(): stmt for stmt in script.statements}
+        try:
+            self.cursor.execute("""
+                SELECT query_text
+                FROM TABLE(information_schema.query_history_by_session(result_limit => 100))
+                WHERE execution_status LIKE 'FAILED%'
+                ORDER BY start_time DESC""")
+            rows = self.cursor.fetchall()
+        except Exception:
+            sys.stderr.write(f"Couldn't find the failed statement of the script in the query history ({error})\n")
+            return None
+        for query_text, in rows:
+            stmt = statements.get(' '.join(str(query_text).split()).rstrip(';').strip())
+            if stmt is not None:
+                return stmt
+        return None
 
     def clean_specific_schemas(self, schemata: List[str]):
         """ Drop a specific list of schemata
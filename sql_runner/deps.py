@@ -1,22 +1,78 @@
 import os
 import re
+import time
 
-import networkx as nx
 import csv
 import json
+import multiprocessing
 from hashlib import md5
 from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from glob import glob
 from sql_runner.db import get_db_and_query_classes, DB
 from sql_runner import parsing
 from types import SimpleNamespace
-from typing import Set, List, Dict, Tuple
+from typing import Set, List, Dict, Tuple, Union, TYPE_CHECKING
 from functools import lru_cache
 
+if TYPE_CHECKING:
+    # Only `--deps` needs networkx, so it's imported where the graph is drawn
+    import networkx
+
 
 Dependency = namedtuple("Dependency", ['md5', 'source_schema', 'source_table', 'dependent_schema', 'dependent_table'])
 
 
+def parse_dependencies(dependent_schema: str, dependent_table: str, select_stmt: str,
+                       lightweight: bool = False) -> Tuple[str, str, List[Tuple[str, str]]]:
+    """ Dependent node and sources of the SQL of a file. A function of its own, so that it can run in worker processes
+    """
+    # deduplicate sources
+    sources = set()
+    has_explicit_dependencies = False
+    for query in parsing.Query.get_queries(select_stmt, lightweight=lightweight):
+        ignored_dependencies = set()
+        override_dependencies = None
+        additional_dependencies = set()
+
+        # first retrieve any functional comments that have information about dependencies
+        for comment in query.comment_contents():
+            functional_comment = None
+            try:
+                functional_comment = json.loads(comment)
+            except:
+                continue
+
+            if 'node_id' in functional_comment:
+                # Bug when reading dependencies
+                dependent_schema, dependent_table = functional_comment['node_id']
+            if 'override_dependencies' in functional_comment:
+                sources = set()
+                for schema, table in functional_comment['override_dependencies']:
+                    sources.add((schema, table))
+                has_explicit_dependencies = True
+            if 'ignore_dependencies' in functional_comment:
+                for schema, table in functional_comment['ignore_dependencies']:
+                    ignored_dependencies.add((schema, table))
+            if 'additional_dependencies' in functional_comment:
+                for schema, table in functional_comment['additional_dependencies']:
+                    additional_dependencies.add((schema, table))
+
+        # If there aren't explicit dependencies, get them from query sources.
+        if not has_explicit_dependencies:
+            for source in query.sources():
+                # Ignore sources without a specified schema
+                if source.schema:
+                    source_schema = source.schema.lower()
+                    source_table = source.relation.lower()
+                    sources.add((source_schema, source_table))
+
+            # Add / remove dependencies depending on functional comments
+            sources.update(additional_dependencies)
+            sources.difference_update(ignored_dependencies)
+    return dependent_schema, dependent_table, sorted(sources)
+
+
 class Dependencies:
     # Version used for dependency caching invalidation
     # Increment version when you make changes that impact detected dependencies
@@ -30,27 +86,54 @@ class Dependencies:
         for d in cached_dependencies:
             dependency_cache[d['md5']].append(d)
 
+        # Unchanged files are recognized by their size, modification time and inode, without reading them
+        known_files: Dict[str, Dict[str, str]] = self.load_file_cache()
+        self.files: Dict[str, Dict[str, str]] = {}
+        # Files modified less than a second before the scan could be modified again without a visible change of their
+        # modification time, so they're always read next time
+        scan_start_ns = time.time_ns() - 1_000_000_000
+
         self.dependencies: List[Dict[str, str]] = []
         # To make sure dependencies are unique
         dependencies_set = set()
-        for file_path in glob(config.sql_path + '/*/*.sql'):
+        # Files that aren't in the cache: checksum, dependent schema and table, and SQL
+        cache_misses: List[Tuple[str, str, str, str]] = []
+        for file_path in sorted(glob(config.sql_path + '/*/*.sql')):
             base_dir_name = os.path.basename(os.path.dirname(file_path))
             file_name = os.path.basename(file_path)
             if base_dir_name in config.exclude_dependencies:
                 continue
 
+            relative_path = f"{base_dir_name}/{file_name}"
+            stat = os.stat(file_path)
+            file_stat = {'size': str(stat.st_size), 'mtime_ns': str(stat.st_mtime_ns), 'inode': str(stat.st_ino)}
+            known = known_files.get(relative_path)
+            if known and all(known[key] == value for key, value in file_stat.items()) \
+                    and known['version'] == Dependencies.VERSION.decode() \
+                    and int(known['dependencies']) == len(dependency_cache.get(known['md5'], ())):
+                checksum = known['md5']
+                self.files[relative_path] = dict(known, path=relative_path)
+                for dep in dependency_cache.get(checksum, ()):
+                    dependencies_set.add(Dependency(
+                        dep['md5'],
+                        dep['source_schema'],
+                        dep['source_table'],
+                        dep['dependent_schema'],
+                        dep['dependent_table']
+                    ))
+                continue
+
             with open(file_path, 'r', encoding=getattr(self.config, 'encoding', 'utf-8')) as sql_file:
                 select_stmt = sql_file.read()
                 hash_md5 = md5()
                 hash_md5.update(Dependencies.VERSION)
-                hash_md5.update(f"{base_dir_name}/{file_name}".encode('utf-8'))
+                hash_md5.update(relative_path.encode('utf-8'))
                 hash_md5.update(select_stmt.encode("utf-8"))
                 checksum = hash_md5.hexdigest()
                 if select_stmt == '':
                     continue
-
-            dependent_schema = base_dir_name
-            dependent_table = file_name[:-4]
+            if stat.st_mtime_ns < scan_start_ns:
+                self.files[relative_path] = dict(path=relative_path, md5=checksum, **file_stat)
 
             cache_key = checksum
             if cache_key in dependency_cache:
@@ -63,60 +146,46 @@ class Dependencies:
                         dep['dependent_table']
                     ))
                 continue
+            cache_misses.append((checksum, base_dir_name, file_name[:-4], select_stmt))
 
-            # deduplicate sources
-            sources = set()
-            has_explicit_dependencies = False
-            for query in parsing.Query.get_queries(select_stmt):
-                ignored_dependencies = set()
-                override_dependencies = None
-                additional_dependencies = set()
-
-                # first retrieve any functional comments that have information about dependencies
-                for comment in query.comment_contents():
-                    functional_comment = None
-                    try:
-                        functional_comment = json.loads(comment)
-                    except:
-                        continue
-
-                    if 'node_id' in functional_comment:
-                        # Bug when reading dependencies
-                        dependent_schema, dependent_table = functional_comment['node_id']
-                    if 'override_dependencies' in functional_comment:
-                        sources = set()
-                        for schema, table in functional_comment['override_dependencies']:
-                            sources.add((schema, table))
-                        has_explicit_dependencies = True
-                    if 'ignore_dependencies' in functional_comment:
-                        for schema, table in functional_comment['ignore_dependencies']:
-                            ignored_dependencies.add((schema, table))
-                    if 'additional_dependencies' in functional_comment:
-                        for schema, table in functional_comment['additional_dependencies']:
-                            additional_dependencies.add((schema, table))
-
-                # If there aren't explicit dependencies, get them from query sources.
-                if not has_explicit_dependencies:
-                    for source in query.sources():
-                        # Ignore sources without a specified schema
-                        if source.schema:
-                            source_schema = source.schema.lower()
-                            source_table = source.relation.lower()
-                            sources.add((source_schema, source_table))
-
-                    # Add / remove dependencies depending on functional comments
-                    sources.update(additional_dependencies)
-                    sources.difference_update(ignored_dependencies)
-
+        for (checksum, _, _, _), (dependent_schema, dependent_table, sources) in \
+                zip(cache_misses, self.parse_all(cache_misses)):
             for source_schema, source_table in sources:
                 # Doing it with a set, eliminates the bug where multiple files with the same name, parent directory
                 # and content hash, contribute to duplication of dependencies after each run
                 dependencies_set.add(
                     Dependency(checksum, source_schema, source_table, dependent_schema, dependent_table)
                 )
-        self.dependencies = list(dep._asdict() for dep in dependencies_set)
+        # Sorted, so that the cache and the saved dependencies don't depend on the order files were parsed in
+        self.dependencies = list(dep._asdict() for dep in sorted(dependencies_set))
         self.save_cache()
 
+    @staticmethod
+    def worker_count(config: SimpleNamespace) -> int:
+        """ Number of processes that parse queries, from `"deps_workers"`
+        """
+        workers = getattr(config, 'deps_workers', None)
+        if not workers:
+            # Spawned processes import the main module again, which only works if it's guarded by `__main__`
+            workers = (os.cpu_count() or 1) if multiprocessing.get_start_method() == 'fork' else 1
+        return int(workers)
+
+    def parse_all(self, files: List[Tuple[str, str, str, str]]) -> List[Tuple[str, str, List[Tuple[str, str]]]]:
+        """ Dependent node and sources of every file, in the same order. Parsed in `"deps_workers"` processes, by
+        default one per CPU where processes are forked
+        """
+        workers = min(Dependencies.worker_count(self.config), len(files))
+        lightweight = bool(getattr(self.config, 'lightweight_lexer', False))
+        arguments = [(dependent_schema, dependent_table, select_stmt, lightweight)
+                     for _, dependent_schema, dependent_table, select_stmt in files]
+        if workers <= 1:
+            return [parse_dependencies(*args) for args in arguments]
+        print(f"Parsing {len(files)} queries in {workers} processes")
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Results come back in the order of the files, whichever process parsed them
+            return list(executor.map(parse_dependencies, *zip(*arguments),
+                                     chunksize=max(1, len(arguments) // (workers * 4))))
+
     def load_cache(self) -> List[Dict[str, str]]:
         if hasattr(self.config, 'deps_cache'):
             cache_config = self.config.deps_cache
@@ -136,6 +205,38 @@ class Dependencies:
                 writer = csv.DictWriter(fp, self.dependencies[0].keys())
                 writer.writeheader()
                 writer.writerows(self.dependencies)
+            self.save_file_cache()
+
+    def file_cache_location(self) -> Union[str, None]:
+        """ Location of the stat data of the files, next to the dependency cache
+        """
+        if hasattr(self.config, 'deps_cache') and self.config.deps_cache['type'] == 'filesystem':
+            return os.path.splitext(self.config.deps_cache['location'])[0] + '_files.csv'
+        return None
+
+    def load_file_cache(self) -> Dict[str, Dict[str, str]]:
+        location = self.file_cache_location()
+        if location and os.path.exists(location):
+            with open(location, 'r') as fp:
+                return {row['path']: row for row in csv.DictReader(fp)}
+        return {}
+
+    def save_file_cache(self):
+        """ Saves the checksum and stat data of every file, with the number of cached dependencies of the checksum, so
+        that files whose dependencies are missing from the cache aren't taken as unchanged
+        """
+        location = self.file_cache_location()
+        if not location:
+            return
+        dependency_counts: Dict[str, int] = defaultdict(int)
+        for dep in self.dependencies:
+            dependency_counts[dep['md5']] += 1
+        with open(location, 'w') as fp:
+            writer = csv.DictWriter(fp, ['path', 'md5', 'size', 'mtime_ns', 'inode', 'version', 'dependencies'])
+            writer.writeheader()
+            for path, file in sorted(self.files.items()):
+                writer.writerow(dict(file, version=Dependencies.VERSION.decode(),
+                                     dependencies=dependency_counts[file['md5']]))
 
     @property
     @lru_cache(maxsize=1)
@@ -145,9 +246,11 @@ class Dependencies:
 
     @property
     @lru_cache(maxsize=1)
-    def dag(self) -> nx.MultiDiGraph:
+    def dag(self) -> "networkx.MultiDiGraph":
         """Computes a DAG using networkx. Each node is a (schema, table) tuple.
         """
+        # Only needed for drawing the graph, and slow to import
+        import networkx as nx
         dependency_tuples = [(f'{item["source_schema"]}.{item["source_table"]}',
                               f'{item["dependent_schema"]}.{item["dependent_table"]}'
                               ) for item in self.dependencies]
@@ -192,6 +295,7 @@ class Dependencies:
                 'style': 'filled'
             })
         os.environ["PATH"] += os.pathsep + self.config.graphviz_path
+        import networkx as nx
         nx.drawing.nx_pydot.to_pydot(dag).write_svg('dependencies.svg')
         if getattr(self.config, 's3_bucket', False):
             import boto3
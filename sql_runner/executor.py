@@ -0,0 +1,216 @@
+import heapq
+import io
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, List, Tuple, Pattern, Union, Any
+
+from sql_runner import ExecutionError
+from sql_runner.db import DB, Query
+from sql_runner.planner import Node, Plan
+
+
+class OutputRouter(io.TextIOBase):
+    """ Replacement for `sys.stdout` that sends output of worker threads to a per-node buffer, so that the log of
+    every node can be printed as one block
+    """
+    def __init__(self, stream):
+        super().__init__()
+        self.stream = stream
+        self.local = threading.local()
+
+    def start_capture(self):
+        self.local.buffer = io.StringIO()
+
+    def stop_capture(self) -> str:
+        buffer: io.StringIO = self.local.buffer
+        self.local.buffer = None
+        return buffer.getvalue()
+
+    def write(self, text: str) -> int:
+        buffer = getattr(self.local, 'buffer', None)
+        if buffer is not None:
+            return buffer.write(text)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+class ResourcePools:
+    """ Named pools with a limited number of slots, that limit how many queries of a kind run at the same time.
+    Configured with a `pools` config entry, where every query goes to the first pool whose schema patterns (regular
+    expressions) and actions both match. Missing patterns or actions match anything:
+
+        "pools": {
+            "staging_loads": {"slots": 2, "schemas": ["^x_"], "actions": ["t", "e"]},
+            "views": {"slots": 16, "actions": ["v"]}
+        }
+
+    Queries that aren't in any pool are only limited by the number of workers.
+    """
+    def __init__(self, pools_config: Dict[str, Dict]):
+        self.pools_config: Dict[str, Dict] = pools_config or {}
+        ResourcePools.validate(self.pools_config)
+        self.schema_patterns: Dict[str, List[Pattern]] = {
+            name: [re.compile(pattern) for pattern in pool.get('schemas', ())]
+            for name, pool in self.pools_config.items()
+        }
+        self.used: Dict[str, int] = {name: 0 for name in self.pools_config}
+
+    @staticmethod
+    def validate(pools_config: Dict[str, Dict]):
+        """ Raise if the `pools` config has pools that no query could ever run in, or entries of the wrong type
+        """
+        if not isinstance(pools_config, dict):
+            raise Exception('"pools" config has to map pool names to pools')
+        for name, pool in pools_config.items():
+            if not isinstance(pool, dict):
+                raise Exception(f'Pool "{name}" has to be an object with "slots", and optionally "schemas" and '
+                                f'"actions"')
+            slots = pool.get('slots')
+            if not isinstance(slots, int) or isinstance(slots, bool) or slots < 1:
+                raise Exception(f'Pool "{name}" needs "slots" as a whole number of at least 1, not {slots!r}')
+            for key in ('schemas', 'actions'):
+                values = pool.get(key, [])
+                if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+                    raise Exception(f'"{key}" of pool "{name}" has to be a list of strings')
+            for pattern in pool.get('schemas', []):
+                try:
+                    re.compile(pattern)
+                except re.error as ex:
+                    raise Exception(f'Schema pattern "{pattern}" of pool "{name}" is invalid: {ex}')
+
+    def pool_of(self, schema_name: str, action: str) -> Union[str, None]:
+        """ Name of the pool that a query belongs to
+        """
+        for name, pool in self.pools_config.items():
+            patterns = self.schema_patterns[name]
+            if patterns and not any(pattern.search(schema_name) for pattern in patterns):
+                continue
+            if 'actions' in pool and action not in pool['actions']:
+                continue
+            return name
+        return None
+
+    def has_free_slot(self, name: Union[str, None]) -> bool:
+        return name is None or self.used[name] < self.pools_config[name]['slots']
+
+    def acquire(self, name: Union[str, None]):
+        if name is not None:
+            self.used[name] += 1
+
+    def release(self, name: Union[str, None]):
+        if name is not None:
+            self.used[name] -= 1
+
+
+class ParallelExecutor:
+    """ Runs the queries of a query list on a bounded pool of worker threads. Every query is dispatched as soon as
+    all of its upstream queries finished. Every worker has its own DB instance, whose connection goes back to the
+    connection pool when the run finishes.
+    When more queries are ready than there are free workers, the ones with the highest priority go first, as long
+    as their resource pool has a free slot.
+    """
+    def __init__(self, queries: List[Query], plan: Plan, db_factory: Callable[[], DB], jobs: int,
+                 priorities: List[float] = None, pools: ResourcePools = None):
+        self.queries: List[Query] = queries
+        self.db_factory: Callable[[], DB] = db_factory
+        self.jobs: int = jobs
+        self.local = threading.local()
+        self.dbs: List[DB] = []
+        self.dbs_lock = threading.Lock()
+        self.priorities: List[float] = priorities or [0.0] * len(queries)
+        self.pools: ResourcePools = pools or ResourcePools({})
+        self.query_pools: List[Union[str, None]] = [self.pools.pool_of(query.schema_name, query.action)
+                                                    for query in queries]
+
+        # Queries are in the same order as the plan
+        index: Dict[Node, int] = {node: i for i, node in enumerate(plan.order)}
+        # Number of unfinished upstream queries, and the reverse relation, per query index
+        self.waiting_for: List[int] = [len(plan.upstream[node]) for node in plan.order]
+        self.downstream: List[List[int]] = [sorted(index[down] for down in plan.downstream[node])
+                                            for node in plan.order]
+
+    def db(self) -> DB:
+        """ DB instance of the current worker thread
+        """
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = self.local.db = self.db_factory()
+            with self.dbs_lock:
+                self.dbs.append(db)
+        return db
+
+    def run_captured(self, run_query: Callable[[Query, DB], Any], index: int, router: OutputRouter) -> str:
+        router.start_capture()
+        try:
+            run_query(self.queries[index], self.db())
+        finally:
+            log = router.stop_capture()
+            self.logs[index] = log
+        return log
+
+    def run(self, run_query: Callable[[Query, DB], Any]):
+        """ Execute `run_query(query, db)` for every query, respecting dependencies
+        """
+        self.logs: Dict[int, str] = {}
+        # Logs are printed in list order, as soon as all previous queries are finished
+        next_to_print = 0
+        # Heap of (-priority, index) of queries that can start
+        ready: List[Tuple[float, int]] = [(-self.priorities[i], i) for i, count in enumerate(self.waiting_for)
+                                          if count == 0]
+        heapq.heapify(ready)
+        running: Dict[Any, int] = {}
+        failure: BaseException = None
+
+        router = OutputRouter(sys.stdout)
+        sys.stdout = router
+        try:
+            with ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix='sql_runner') as pool:
+                while ready or running:
+                    # Queries whose pool is full wait until a query of the same pool finishes
+                    waiting_for_slot: List[Tuple[float, int]] = []
+                    while ready and len(running) < self.jobs and failure is None:
+                        priority, index = heapq.heappop(ready)
+                        if not self.pools.has_free_slot(self.query_pools[index]):
+                            waiting_for_slot.append((priority, index))
+                            continue
+                        self.pools.acquire(self.query_pools[index])
+                        running[pool.submit(self.run_captured, run_query, index, router)] = index
+                    for item in waiting_for_slot:
+                        heapq.heappush(ready, item)
+                    if not running:
+                        # Can't happen with valid pools, but queries must never be left out silently
+                        raise ExecutionError('Queries are waiting for a pool slot while nothing is running: ' +
+                                             ', '.join(self.queries[index].full_table_name for _, index in ready))
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        index = running.pop(future)
+                        self.pools.release(self.query_pools[index])
+                        exc = future.exception()
+                        if exc is not None:
+                            if failure is None:
+                                failure = exc
+                                # Show what the failing query printed, even if it's out of order
+                                router.stream.write(self.logs.pop(index, ''))
+                            continue
+                        for child in self.downstream[index]:
+                            self.waiting_for[child] -= 1
+                            if self.waiting_for[child] == 0:
+                                heapq.heappush(ready, (-self.priorities[child], child))
+                    while next_to_print in self.logs:
+                        router.stream.write(self.logs.pop(next_to_print))
+                        next_to_print += 1
+                    if failure is not None:
+                        ready = []
+        finally:
+            sys.stdout = router.stream
+            # Print what's left from finished queries, in list order
+            for index in sorted(self.logs):
+                sys.stdout.write(self.logs[index])
+            for db in self.dbs:
+                db.close()
+        if failure is not None:
+            raise failure
@@ -0,0 +1,80 @@
+import datetime
+import statistics
+import threading
+from collections import defaultdict, namedtuple
+from types import SimpleNamespace
+from typing import List, Dict, Tuple, Union
+
+from sql_runner import ExecutionType
+from sql_runner.db import DB
+
+
+# One row of the `run_history` table. Node rows have no `statement_index`
+HistoryRecord = namedtuple("HistoryRecord", ['run_id', 'execution_type', 'schema_name', 'table_name',
+                                             'statement_index', 'started_at', 'duration_seconds', 'row_count',
+                                             'status'])
+
+
+class RunHistory:
+    """ Durations, row counts and status of every node and statement of a run, to be saved in the `run_history`
+    table in the `deps_schema` schema. Enabled with `"run_history": true` in the config.
+    """
+    def __init__(self, config: SimpleNamespace, run_id: str, execution_type: ExecutionType):
+        self.config = config
+        self.run_id: str = run_id
+        self.execution_type: ExecutionType = execution_type
+        self.records: List[HistoryRecord] = []
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(getattr(self.config, 'run_history', False)) and bool(getattr(self.config, 'deps_schema', None))
+
+    def add(self, node: Tuple[str, str], statement_index: Union[int, None], started_at: datetime.datetime,
+            duration: datetime.timedelta, row_count: Union[int, None], status: str):
+        if not self.enabled:
+            return
+        record = HistoryRecord(self.run_id, self.execution_type.value, node[0], node[1], statement_index,
+                               started_at, duration.total_seconds(), row_count, status)
+        with self.lock:
+            self.records.append(record)
+
+    def save(self, db: DB):
+        """ Bulk-write the records of this run
+        """
+        if not self.enabled or not self.records:
+            return
+        db.save_run_history(self.config.deps_schema, self.records)
+
+
+def report_regressions(config: SimpleNamespace, db: DB) -> int:
+    """ Print the nodes whose duration in their latest successful run is more than `factor` times the median of their
+    previous `window` successful runs. Returns the number of regressions.
+    """
+    regression_config: Dict = getattr(config, 'regressions', None) or {}
+    factor: float = float(regression_config.get('factor', 1.5))
+    window: int = int(regression_config.get('window', 10))
+    min_runs: int = int(regression_config.get('min_runs', 3))
+    execution_type: str = regression_config.get('execution_type', ExecutionType.execute.value)
+
+    durations: Dict[Tuple[str, str], List[float]] = defaultdict(list)
+    for schema_name, table_name, duration_seconds in db.load_run_history(config.deps_schema, execution_type):
+        durations[(schema_name, table_name)].append(float(duration_seconds))
+
+    regressions = []
+    for node, node_durations in durations.items():
+        latest = node_durations[-1]
+        previous = node_durations[-window - 1:-1]
+        if len(previous) < min_runs:
+            continue
+        median = statistics.median(previous)
+        if median > 0 and latest > factor * median:
+            regressions.append((latest / median, node, latest, median))
+
+    if not regressions:
+        print(f'No node got slower than {factor} times its median duration')
+        return 0
+    print(f'Nodes slower than {factor} times the median of their previous {window} runs:')
+    for ratio, (schema_name, table_name), latest, median in sorted(regressions, reverse=True):
+        print(f'\t{schema_name}.{table_name}: {latest:.1f}s, median {median:.1f}s ({ratio:.1f}x)')
+    return len(regressions)
@@ -0,0 +1,111 @@
+import re
+import threading
+from typing import Dict, List, Pattern, Set, Tuple, Union
+
+
+class StatementOptimizer:
+    """ Removes statements that don't need to run, between statement generation and execution:
+
+    * statements without anything to execute, like empty ones or ones with only comments
+    * idempotent DDL that already ran in this run, like creating the same schema for every query in it
+
+    When queries run concurrently, the first query that needs a run-once statement claims it, and other queries that
+    need it wait until it's executed. If the claiming query fails, the next one executes the statement.
+    """
+    # Statements that have the same effect however often they run, so running them once per run is enough
+    run_once_patterns: List[Pattern] = [
+        re.compile(r'^CREATE\s+SCHEMA\s+IF\s+NOT\s+EXISTS\s+\S+$', re.IGNORECASE),
+        # Azure Synapse Analytics
+        re.compile(r'^IF\s+NOT\s+.*\s+EXEC\s*\(\s*\'CREATE\s+SCHEMA\s+[^\']+\'\s*\)$', re.IGNORECASE | re.DOTALL),
+    ]
+    # Hand-written statements that undo run-once statements
+    invalidating_pattern: Pattern = re.compile(r'\bDROP\s+SCHEMA\b', re.IGNORECASE)
+    comment_pattern: Pattern = re.compile(r'--[^\n]*|/\*.*?\*/', re.DOTALL)
+
+    def __init__(self, enabled: bool = True):
+        self.enabled: bool = enabled
+        self.lock = threading.Lock()
+        # Run-once statements that were executed, and the ones being executed by some query
+        self.done: Set[str] = set()
+        self.claims: Dict[str, threading.Event] = {}
+        self.saved: Dict[str, int] = {'repeated': 0, 'empty': 0}
+
+    @staticmethod
+    def normalize(stmt: str) -> str:
+        return ' '.join(stmt.split()).rstrip(';').strip()
+
+    @staticmethod
+    def is_noop(stmt: str) -> bool:
+        return StatementOptimizer.comment_pattern.sub('', stmt).strip().strip(';').strip() == ''
+
+    @staticmethod
+    def run_once_key(stmt: str) -> Union[str, None]:
+        normalized = StatementOptimizer.normalize(stmt)
+        if any(pattern.match(normalized) for pattern in StatementOptimizer.run_once_patterns):
+            return normalized
+        return None
+
+    def optimize(self, query, statements: List[str]) -> Tuple[List[str], List[str]]:
+        """ Statements of a query that have to be executed, and the run-once statements claimed for them. Waits for
+        run-once statements that other queries are executing
+        """
+        if not self.enabled:
+            return statements, []
+        kept = [stmt for stmt in statements if not StatementOptimizer.is_noop(stmt)]
+        with self.lock:
+            self.saved['empty'] += len(statements) - len(kept)
+
+        if not query.idempotent:
+            # Hand-written statements are kept as they are, but they can drop schemata that were created
+            if any(StatementOptimizer.invalidating_pattern.search(stmt) for stmt in kept):
+                with self.lock:
+                    self.done.clear()
+            return kept, []
+
+        keys: Dict[str, str] = {stmt: StatementOptimizer.run_once_key(stmt) for stmt in kept}
+        needed: Set[str] = {key for key in keys.values() if key is not None}
+        while True:
+            # Claims are only taken when none are being waited for, so queries never wait for each other in a loop
+            with self.lock:
+                in_progress = [self.claims[key] for key in needed if key in self.claims]
+                if not in_progress:
+                    claimed = [key for key in needed if key not in self.done]
+                    for key in claimed:
+                        self.claims[key] = threading.Event()
+                    break
+            for event in in_progress:
+                event.wait()
+
+        result: List[str] = []
+        seen: Set[str] = set()
+        for stmt in kept:
+            key = keys[stmt]
+            if key is not None and (key not in claimed or key in seen):
+                with self.lock:
+                    self.saved['repeated'] += 1
+                continue
+            seen.add(key)
+            result.append(stmt)
+        # Claimed statements go first, so that queries waiting for them don't wait for the rest of this query. They
+        # don't depend on the statements before them, since they only create what doesn't exist yet
+        result.sort(key=lambda stmt: keys[stmt] not in claimed)
+        return result, claimed
+
+    def release(self, claimed: List[str], succeeded: bool):
+        """ Mark the claimed run-once statements as executed, or free them for other queries if they failed
+        """
+        with self.lock:
+            for key in claimed:
+                event = self.claims.pop(key)
+                if succeeded:
+                    self.done.add(key)
+                event.set()
+
+    @property
+    def saved_total(self) -> int:
+        return sum(self.saved.values())
+
+    def report(self):
+        if self.saved_total:
+            print(f'Statement optimizer saved {self.saved_total} statements ({self.saved["repeated"]} repeated, '
+                  f'{self.saved["empty"]} empty)')
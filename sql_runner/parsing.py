@@ -1,4 +1,6 @@
 import sqlparse
+import sqlparse.engine
+import sqlparse.lexer
 import re
 from functools import lru_cache
 from typing import List, Iterator, Iterable, Union, Tuple
@@ -63,13 +65,47 @@ class Query:
         self.end_quotes: str = end_quotes
 
     @staticmethod
-    def get_queries(statement: str, start_quotes: str = '"', end_quotes: str = '"') -> Iterator["Query"]:
-        """ Gets the Query objects from a string SQL statement
+    def get_queries(statement: str, start_quotes: str = '"', end_quotes: str = '"',
+                    lightweight: bool = False) -> Iterator["Query"]:
+        """ Gets the Query objects from a string SQL statement. The `lightweight` lexer skips the grouping of
+        `sqlparse.parse`, see `Query.scan`
         """
+        if lightweight:
+            for tokens in Query.scan(statement):
+                yield Query(tokens, start_quotes, end_quotes)
+            return
         stmts = sqlparse.parse(statement)
         for stmt in stmts:
             yield Query(list(stmt.flatten()), start_quotes, end_quotes)
 
+    @staticmethod
+    def scan(statement: str) -> Iterator[List[sqlparse.sql.Token]]:
+        """ Tokens of every statement in a string, in a single pass over it. Most of the time of `sqlparse.parse` goes
+        into grouping tokens into identifiers, functions, etc., but `tokens_as_str` only needs the tokens themselves,
+        and whether a FROM is within a function call, like `EXTRACT(YEAR FROM ...)`. That's tracked here with the
+        parentheses, and such FROM tokens get a function as their parent, like they would from `sqlparse.parse`
+        """
+        for stmt in sqlparse.engine.StatementSplitter().process(sqlparse.lexer.tokenize(statement)):
+            tokens: List[sqlparse.sql.Token] = list(stmt.flatten())
+            # The function of every open parenthesis, if it belongs to a function call
+            parentheses: List[Union[sqlparse.sql.Function, None]] = []
+            previous: Union[sqlparse.sql.Token, None] = None
+            for token in tokens:
+                if token.ttype in sqlparse.tokens.Punctuation and token.value == '(':
+                    # Like for sqlparse, a function is a name followed by parentheses
+                    is_call = previous is not None and previous.ttype in sqlparse.tokens.Name
+                    parentheses.append(sqlparse.sql.Function([]) if is_call else None)
+                elif token.ttype in sqlparse.tokens.Punctuation and token.value == ')':
+                    if parentheses:
+                        parentheses.pop()
+                elif token.ttype in sqlparse.tokens.Keyword and 'FROM' in token.value.upper():
+                    function = next((function for function in reversed(parentheses) if function is not None), None)
+                    if function is not None:
+                        token.parent = function
+                if not token.is_whitespace:
+                    previous = token
+            yield tokens
+
     def clear_caches(self):
         self.tokens_as_str.cache_clear()
         self.has_dml.cache_clear()
@@ -196,20 +232,23 @@ class Query:
                 return destination
 
     @lru_cache(maxsize=1)
-    def comment_contents(self) -> Iterator[str]:
+    def comment_contents(self) -> List[str]:
+        # A list, since a cached generator would be exhausted for the next caller
+        contents: List[str] = []
         for token in self.tokens:
             if token.ttype in sqlparse.tokens.Comment.Multiline:
                 if token.value.startswith('/*'):
-                    yield token.value[2:-2].strip()
+                    contents.append(token.value[2:-2].strip())
                 else:
-                    yield token.value.strip()
+                    contents.append(token.value.strip())
             elif token.ttype in sqlparse.tokens.Comment.Single:
                 if token.value.startswith('--'):
-                    yield token.value[2:].strip()
+                    contents.append(token.value[2:].strip())
                 elif token.value.startswith('#'):
-                    yield token.value[1:].strip()
+                    contents.append(token.value[1:].strip())
                 else:
-                    yield token.value.strip()
+                    contents.append(token.value.strip())
+        return contents
 
     @lru_cache(maxsize=1)
     def without_ddl(self) -> "Query":
@@ -0,0 +1,149 @@
+import heapq
+import sys
+from collections import defaultdict
+from typing import Dict, List, Set, Tuple, Iterable
+
+
+Node = Tuple[str, str]
+
+
+class DependencyGraph:
+    """ Dependency list, indexed in both directions. Each node is a (schema, table) tuple.
+    """
+    def __init__(self, dependencies: Iterable[Dict[str, str]]):
+        self.upstream: Dict[Node, List[Node]] = defaultdict(list)
+        self.downstream: Dict[Node, List[Node]] = defaultdict(list)
+        edges = set()
+        for d in dependencies:
+            edge = ((d['source_schema'], d['source_table']), (d['dependent_schema'], d['dependent_table']))
+            # The same edge can be detected in multiple files (ex. with `node_id`)
+            if edge in edges:
+                continue
+            edges.add(edge)
+            source, dependent = edge
+            self.upstream[dependent].append(source)
+            self.downstream[source].append(dependent)
+
+    @staticmethod
+    def closure(nodes: Iterable[Node], edges: Dict[Node, List[Node]]) -> Set[Node]:
+        """ All the nodes reachable from `nodes` following `edges`, without the starting nodes themselves
+        """
+        found: Set[Node] = set()
+        stack: List[Node] = list(nodes)
+        while stack:
+            for node in edges.get(stack.pop(), ()):
+                if node not in found:
+                    found.add(node)
+                    stack.append(node)
+        return found
+
+    def ancestors(self, nodes: Iterable[Node]) -> Set[Node]:
+        """ Everything that `nodes` depend on, directly or indirectly
+        """
+        return DependencyGraph.closure(nodes, self.upstream)
+
+    def descendants(self, nodes: Iterable[Node]) -> Set[Node]:
+        """ Everything that depends on `nodes`, directly or indirectly
+        """
+        return DependencyGraph.closure(nodes, self.downstream)
+
+
+class Plan:
+    """ Run order of the requested nodes.
+
+    `order` is a topological order, `layers` groups the nodes that can run at the same time once all previous layers
+    finished, and `upstream` / `downstream` relate every node to the closest requested nodes it depends on (or that
+    depend on it), also through nodes that are not part of the plan.
+    """
+    def __init__(self):
+        self.order: List[Node] = []
+        self.layers: List[List[Node]] = []
+        self.upstream: Dict[Node, Set[Node]] = {}
+        self.downstream: Dict[Node, Set[Node]] = {}
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+
+class Planner:
+    """ Computes run plans with an iterative, Kahn-style topological sort on the dependency graph
+    """
+    def __init__(self, graph: DependencyGraph):
+        self.graph: DependencyGraph = graph
+
+    def plan(self, requested: Iterable[Node]) -> Plan:
+        """ Plan the requested nodes, and make sure everything they depend on, directly or indirectly, is acyclic.
+        Nodes that are ready at the same time are ordered as requested.
+        """
+        position: Dict[Node, int] = {}
+        for node in requested:
+            position.setdefault(node, len(position))
+
+        # Sub-graph of everything the requested nodes depend on
+        nodes = set(position) | self.graph.ancestors(position)
+        waiting_for: Dict[Node, int] = {node: len(self.graph.upstream.get(node, ())) for node in nodes}
+
+        # Nodes that aren't requested have nothing to run, so they're handled first
+        ready: List[Tuple[int, int, Node]] = []
+        for node in nodes:
+            if waiting_for[node] == 0:
+                heapq.heappush(ready, (position.get(node, -1), 0, node))
+        # Tie breaker for nodes that aren't requested, which aren't comparable otherwise
+        counter = 1
+
+        plan = Plan()
+        # Closest requested upstream nodes, and layer of requested nodes
+        requested_upstream: Dict[Node, Set[Node]] = {}
+        layer: Dict[Node, int] = {}
+        processed = 0
+        while ready:
+            _, _, node = heapq.heappop(ready)
+            processed += 1
+            upstream: Set[Node] = set()
+            for up in self.graph.upstream.get(node, ()):
+                if up in position:
+                    upstream.add(up)
+                else:
+                    upstream.update(requested_upstream[up])
+            requested_upstream[node] = upstream
+
+            if node in position:
+                plan.order.append(node)
+                plan.upstream[node] = upstream
+                plan.downstream[node] = set()
+                for up in upstream:
+                    plan.downstream[up].add(node)
+                layer[node] = max((layer[up] + 1 for up in upstream), default=0)
+                if layer[node] == len(plan.layers):
+                    plan.layers.append([])
+                plan.layers[layer[node]].append(node)
+
+            for down in self.graph.downstream.get(node, ()):
+                if down in waiting_for:
+                    waiting_for[down] -= 1
+                    if waiting_for[down] == 0:
+                        heapq.heappush(ready, (position.get(down, -1), counter, down))
+                        counter += 1
+
+        if processed < len(nodes):
+            self.report_cycle({node for node, count in waiting_for.items() if count > 0}, position)
+        return plan
+
+    def report_cycle(self, blocked: Set[Node], position: Dict[Node, int]):
+        """ Print a dependency cycle between the `blocked` nodes, and fail
+        """
+        # Every blocked node depends on at least one other blocked node, so walking upstream has to loop eventually
+        node = min(blocked, key=lambda n: (position.get(n, len(position)), n))
+        path: List[Node] = []
+        seen: Dict[Node, int] = {}
+        while node not in seen:
+            seen[node] = len(path)
+            path.append(node)
+            node = next(up for up in self.graph.upstream[node] if up in blocked)
+
+        schema, table = node
+        print(f'Error: "{schema}"."{table}" generates a cyclical dependency:', file=sys.stderr)
+        # Write the dependency chain until the same point is reached
+        for past_call in reversed(path[seen[node]:]):
+            print(f'\trequired by "{past_call[0]}"."{past_call[1]}"', file=sys.stderr)
+        raise RecursionError("Cyclical dependency detected")
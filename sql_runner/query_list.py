@@ -2,12 +2,22 @@ import csv
 import datetime
 import io
 import sys
-from collections import defaultdict, deque
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import md5
 from types import SimpleNamespace
-from typing import Dict, List, Tuple, Callable, Iterable, Set, Union
+from typing import Dict, List, Callable, Iterable, Set, Union
 
-from sql_runner import ExecutionType
-from sql_runner.db import DB, get_db_and_query_classes
+from sql_runner import ExecutionType, ExecutionError
+from sql_runner.db import DB, Catalog, StatementScript, get_db_and_query_classes
+from sql_runner.executor import ParallelExecutor, ResourcePools
+from sql_runner.history import RunHistory
+from sql_runner.optimizer import StatementOptimizer
+from sql_runner.planner import DependencyGraph, Node, Plan, Planner
+from sql_runner.selection import NodeSelector
+from sql_runner.state import RunState, Checkpoint
+from sql_runner.trace import tracer
 
 
 class QueryList(list):
@@ -17,12 +27,35 @@ class QueryList(list):
         't': 'create_table_stmt',
         # For testing whether the query works
         'mock': 'create_mock_relation_stmt',
+        # For validating the query without creating anything
+        'explain': 'explain_stmt',
         'v': 'create_view_stmt',
         'm': 'materialize_view_stmt',
+        # Merges the new rows into the table that an earlier run built
+        'i': 'merge_stmt',
         'check': 'run_check_stmt',
         's': 'skip'
     }
 
+    # Assumed duration in seconds of a query that has never been measured, by action
+    estimated_durations: Dict[str, float] = {
+        'e': 60.0,
+        't': 60.0,
+        'mock': 1.0,
+        'explain': 1.0,
+        'v': 1.0,
+        'm': 60.0,
+        'i': 60.0,
+        'check': 10.0,
+        's': 0.0
+    }
+
+    # Actions that can be skipped by an incremental run, when the query and its upstream queries didn't change
+    incremental_actions: Set[str] = {'t', 'v', 'm'}
+
+    # Actions whose relations a clone staging run can copy from production, instead of building them
+    clone_actions: Set[str] = {'t', 'v', 'm', 'i'}
+
     def __init__(self, config: SimpleNamespace, args: SimpleNamespace, csv_string: str,
                  dependencies: List[Dict], execution_type: ExecutionType):
         super().__init__()
@@ -30,63 +63,107 @@ class QueryList(list):
         DBClass, QueryClass = get_db_and_query_classes(config)
         self.config = config
         self.cold_run = args.cold_run
+        self.jobs: int = max(1, getattr(args, 'jobs', 1) or 1)
+        # Every worker holds a connection, next to the one of the run itself
+        max_connections = getattr(config, 'max_connections', None)
+        if max_connections and self.jobs > 1 and self.jobs >= max_connections:
+            self.jobs = max(1, max_connections - 1)
+            print(f'Running {self.jobs} jobs, within "max_connections": {max_connections}')
+        # Limits of parallel runs per kind of query, validated before anything runs
+        self.pools = ResourcePools(getattr(config, 'pools', None))
+        self.DBClass = DBClass
         self.db: DB = DBClass(config, args.cold_run)
+        if execution_type == ExecutionType.estimate and not DBClass.supports_estimates:
+            raise Exception("`--estimate` needs a database with dry runs (BigQuery)")
+        # Bytes that every query would process, with `--estimate`
+        self.estimated_bytes: Dict[Node, int] = {}
+        self.created_schemata: Set[str] = set()
+        self.state = RunState(config)
+        # Measured duration of every query executed successfully in this run, in seconds
+        self.durations: Dict[Node, float] = {}
+        # Skip queries that are unchanged since their last successful build
+        self.incremental: bool = getattr(args, 'incremental', False) \
+            and execution_type in (ExecutionType.execute, ExecutionType.staging)
+        self.previous_fingerprints: Dict[Node, str] = self.state.load_fingerprints(execution_type)
+        # Fingerprints of the queries successfully built or skipped in this run
+        self.fingerprints: Dict[Node, str] = {}
+        # Checksums of the SQL of the queries built or skipped by an execute run, to find changes in clone staging
+        self.sources: Dict[Node, str] = {}
+        # Queries that finished in this run, whatever their status
+        self.finished: Set[Node] = set()
+        # Queries that were actually executed in this run
+        self.executed: Set[Node] = set()
+        # Queries whose statements started executing. Their relations may be gone unless they complete, so their
+        # fingerprints and checksums from earlier runs are removed if they don't
+        self.started: Set[Node] = set()
+        # Nodes completed by this run are recorded, so that it can be resumed if it fails
+        self.checkpoint = Checkpoint(self.state, getattr(args, 'resume', None) or Checkpoint.new_run_id(),
+                                     execution_type)
+        self.completed: Set[Node] = set()
+        if getattr(args, 'resume', None):
+            if execution_type not in (ExecutionType.execute, ExecutionType.staging):
+                raise Exception("Only execute and staging runs can be resumed")
+            self.completed = self.checkpoint.load()
+        self.history = RunHistory(config, self.checkpoint.run_id, execution_type)
+        # Send the generated statements of a query as one script, with `"batch_statements": true`
+        self.batch_statements: bool = bool(getattr(config, 'batch_statements', False))
+        # Drops repeated schema creations and empty statements, unless `"optimize_statements": false`
+        self.optimizer = StatementOptimizer(getattr(config, 'optimize_statements', True) is not False)
+        # With `--keep-going`, a failed query only stops the queries that depend on it. Validation always reports
+        # every invalid query
+        self.keep_going: bool = getattr(args, 'keep_going', False) \
+            or execution_type in (ExecutionType.validate, ExecutionType.estimate)
+        self.failed: Dict[Node, str] = {}
+        # Queries that weren't run because a query they depend on failed, and the failed query
+        self.upstream_failed: Dict[Node, Node] = {}
         given_order = []
         requested_queries_dict = {}
         for query in csv.DictReader(io.StringIO(csv_string.strip()), delimiter=';'):
             if not query['schema_name'].startswith('#'):
-                given_order.append(query)
+                query['schema_name'], query['table_name'] = query['schema_name'].strip(), query['table_name'].strip()
+                given_order.append((query['schema_name'], query['table_name']))
                 requested_queries_dict[(query['schema_name'], query['table_name'])] = query
 
+        graph = DependencyGraph(dependencies)
+        self.graph: DependencyGraph = graph
+        selectors, exclusions = getattr(args, 'select', None), getattr(args, 'exclude', None)
+        if selectors or exclusions:
+            given_order = NodeSelector(graph).select(given_order, selectors, exclusions)
+            requested_queries_dict = {node: requested_queries_dict[node] for node in given_order}
+            print(f'Selected {len(requested_queries_dict)} queries')
+
         entities_to_be_created_set = set(requested_queries_dict.keys())
 
-        indexed_dependencies = defaultdict(list)
-        for d in dependencies:
-            indexed_dependencies[(d['dependent_schema'], d['dependent_table'])].append(
-                (d['source_schema'], d['source_table'])
-            )
-
-        added_entities_set = set()
-
-        def add_query(schema, table, query_stack: deque) -> int:
-            """ Adds a query that creates schema.table, but first it adds its dependencies recursively
-            """
-            query_key = (schema, table)
-            # Check if this table wasn't already queued for running (not a cyclical dependency)
-            if (schema, table) in query_stack:
-                print(f'Error: "{schema}"."{table}" generates a cyclical dependency:', file=sys.stderr)
-                # Run through the call stack and write the dependency chain until the same point is reached
-                while query_stack:
-                    past_call = query_stack.pop()
-                    print(f'\trequired by "{past_call[0]}"."{past_call[1]}"', file=sys.stderr)
-                    if (schema, table) == past_call:
-                        break
-                raise RecursionError("Cyclical dependency detected")
-
-            query_stack.append(query_key)
-
-            is_top_node = True
-            # if this query depends on other queries, add the dependencies first
-            if query_key in indexed_dependencies:
-                for dep in indexed_dependencies[query_key]:
-                    if add_query(*dep, query_stack=query_stack):
-                        is_top_node = False
-
-            query_stack.pop()
-            if query_key in requested_queries_dict:
-                # Only if this query is requested
-                if query_key not in added_entities_set:
-                    self.append(
-                        QueryClass(config, args, entities_to_be_created_set, execution_type,
+        # Dependencies get added before the queries that need them. Cyclical dependencies are reported and raised
+        with tracer.span('planning', 'planning'):
+            # Validated queries don't create anything, so they don't wait for each other
+            validation = execution_type in (ExecutionType.validate, ExecutionType.estimate)
+            self.plan: Plan = Planner(graph if not validation else DependencyGraph([])).plan(given_order)
+        # Existing schemata and relations, so that statements only drop and create what's needed, and `i` queries
+        # know whether their table has to be built first
+        self.catalog: Union[Catalog, None] = None
+        if getattr(config, 'catalog_snapshot', False) \
+                or any(query['action'] == 'i' for query in requested_queries_dict.values()):
+            with tracer.span('loading catalog', 'planning'):
+                self.catalog = self.db.load_catalog()
+        with tracer.span('loading queries', 'planning'):
+            for query_key in self.plan.order:
+                query = QueryClass(config, args, entities_to_be_created_set, execution_type,
                                    **requested_queries_dict[query_key])
-                    )
-                    added_entities_set.add(query_key)
-                # Tell that this query was added, now or before
-                return True
-            return False
-
-        for query in given_order:
-            add_query(query['schema_name'], query['table_name'], deque())
+                query.catalog = self.catalog
+                self.append(query)
+        # SQL files are read and parsed when their query runs, and dropped after it. With `"prefetch_queries": n`, up
+        # to n of the queries that run next are loaded in the background while a query runs
+        self.prefetch: int = max(0, int(getattr(config, 'prefetch_queries', 0) or 0))
+        self.prefetcher: Union[ThreadPoolExecutor, None] = None
+        self.prefetched: Set[Node] = set()
+        # Finishing a query and checking whether a prefetched one finished meanwhile don't interleave
+        self.prefetch_lock = threading.Lock()
+        self.positions: Dict[Node, int] = {QueryList.node(query): index for index, query in enumerate(self)}
+        # With `"clone": true` in the staging config, queries that didn't change since production are cloned from it
+        self.cloned: Set[Node] = set()
+        if execution_type == ExecutionType.staging and (getattr(config, 'staging', None) or {}).get('clone', False):
+            self.cloned = self.unchanged_since_production(graph) - self.completed
 
     @staticmethod
     def from_csv_files(config: SimpleNamespace, args: SimpleNamespace, csv_files: List[str],
@@ -103,39 +180,357 @@ class QueryList(list):
                 csv_string.append(f.read().strip())
         return QueryList(config, args, '\n'.join(csv_string), dependencies, execution_type)
 
-    def run(self):
-        """ Execute every statement from every query
+    def run_query(self, query, db: DB):
+        """ Execute every statement from a single query
         """
-        run_start = datetime.datetime.now()
-        created_schemata = set()
-        for query in self:
-            start = datetime.datetime.now()
-            if self.execution_type == ExecutionType.test:
-                # Just validate syntax
-                if query.action in {'e', 'check'}:
-                    query.action = 's'
-                else:
-                    query.action = 'mock'
+        node = QueryList.node(query)
+        failed_upstream = self.failed_upstream(node)
+        if failed_upstream:
+            self.upstream_failed[node] = failed_upstream
             print(query)
-            if query.action in QueryList.actions:
-                # Any of 'query', 'create_table_stmt', 'create_view_stmt', 'materialize_view_stmt', 'run_check'
-                stmt_type = QueryList.actions[query.action]
-                statement_generator: Callable[[], Iterable[str]] = query.get_statement_generator(stmt_type)
-                # Get list of individual specific statements and process them
-                for stmt in statement_generator():
-                    self.db.execute(stmt, query)
-
-                    if self.execution_type in (ExecutionType.execute, ExecutionType.staging) and not self.cold_run:
-                        # Validate data only when data is computed properly
-                        assertion = query.assertion
-                        if assertion:
-                            assertion(rows=self.db.fetchall())
-                # Keep track of what gets created in the test
-                if self.execution_type == ExecutionType.test and query.action == 'mock':
-                    created_schemata.add(query.schema)
-            print(datetime.datetime.now() - start)
+            print(f'Skipped, because "{failed_upstream[0]}"."{failed_upstream[1]}" failed')
+            self.history.add(node, None, datetime.datetime.now(), datetime.timedelta(), None, 'upstream_failed')
+            return
+        self.prefetch_after(node)
+        with tracer.span(query.name, 'query'):
+            start = datetime.datetime.now()
+            status = 'failed'
+            try:
+                status = self.execute_query(query, db)
+            except Exception as ex:
+                if not self.keep_going:
+                    raise
+                if not isinstance(ex, ExecutionError):
+                    # Failed assertions and other errors weren't written out yet
+                    traceback.print_exc()
+                self.failed[node] = str(ex) or type(ex).__name__
+            finally:
+                duration = datetime.datetime.now() - start
+                # Skipped, cloned and failed queries would distort the durations the run is planned with
+                if status == 'success' and node in self.executed:
+                    self.durations[node] = duration.total_seconds()
+                with self.prefetch_lock:
+                    self.finished.add(node)
+                    query.unload()
+                self.history.add(node, None, start, duration, None, status)
+            print(duration)
+
+    def prefetch_after(self, node: Node):
+        """ Load the queries that run after a node in the background, so that they're ready when they start: the ones
+        that follow it in the list when queries run one at a time, or else the ones that it's the last upstream query
+        of, which become ready when it finishes
+        """
+        if self.prefetcher is None:
+            return
+        if self.jobs > 1:
+            following = [down for down in sorted(self.plan.downstream[node], key=self.positions.get)
+                         if all(up == node or up in self.finished for up in self.plan.upstream[down])]
+        else:
+            position = self.positions[node]
+            following = [QueryList.node(query) for query in self[position + 1:position + 1 + self.prefetch]]
+        for down in following[:self.prefetch]:
+            if down not in self.prefetched:
+                self.prefetched.add(down)
+                self.prefetcher.submit(self.prefetch_query, self[self.positions[down]])
+
+    def prefetch_query(self, query):
+        node = QueryList.node(query)
+        # Queries that already ran aren't loaded again
+        if node not in self.finished:
+            query.load()
+            # The query can have finished while it was loaded, and nothing would drop it then
+            with self.prefetch_lock:
+                if node in self.finished:
+                    query.unload()
+
+    def execute_query(self, query, db: DB) -> str:
+        """ Generate and execute the statements of a query, unless it can be skipped. Returns the status of the node
+        """
+        if self.execution_type == ExecutionType.test:
+            # Just validate syntax
+            if query.action in {'e', 'check'}:
+                query.action = 's'
+            else:
+                query.action = 'mock'
+        elif self.execution_type in (ExecutionType.validate, ExecutionType.estimate):
+            # Hand-written statements can't be validated without running them. Building views costs nothing
+            if query.action == 'e' or self.execution_type == ExecutionType.estimate and query.action == 'v':
+                query.action = 's'
+            else:
+                query.action = 'explain'
+        print(query)
+        status = 'success'
+        if QueryList.node(query) in self.cloned:
+            print('Unchanged since production, cloned')
+            return 'cloned'
+        if query.action in QueryList.actions:
+            # Any of 'query', 'create_table_stmt', 'create_view_stmt', 'materialize_view_stmt', 'merge_stmt',
+            # 'run_check'
+            stmt_type = QueryList.actions[query.action]
+            statement_generator: Callable[[], Iterable[str]] = query.get_statement_generator(stmt_type)
+            node = QueryList.node(query)
+            fingerprint = ''
+            if self.state.enabled:
+                fingerprint = self.fingerprint(query)
+                # Rendering changes names in place, so the statements are rendered from a fresh parse of the query
+                query.unload()
+            # Statements are generated only once, because names get modified in place
+            with tracer.span('render statements', 'render'):
+                statements: List[str] = list(statement_generator())
+            if node in self.completed:
+                print(f'Completed in run {self.checkpoint.run_id}, skipped')
+                fingerprint = self.previous_fingerprints.get(node, fingerprint)
+                status = 'skipped'
+            elif self.is_unchanged(query, fingerprint):
+                print('Unchanged since the last successful build, skipped')
+                status = 'skipped'
+            else:
+                if self.catalog is not None and not query.idempotent \
+                        and any(Catalog.invalidating_pattern.search(stmt) for stmt in statements):
+                    # Hand-written statements could drop anything
+                    self.catalog.invalidate()
+                self.started.add(node)
+                statements, claimed = self.optimizer.optimize(query, statements)
+                succeeded = False
+                try:
+                    # Claimed run-once statements, which come first, run on their own, so that other queries waiting
+                    # for them can go on before the rest of this query runs
+                    index = 0
+                    while index < len(statements) and StatementOptimizer.run_once_key(statements[index]) in claimed:
+                        self.execute_statement(query, db, index, statements[index])
+                        self.release_claim(StatementOptimizer.run_once_key(statements[index]), claimed)
+                        index += 1
+                    if self.can_batch(query, db, statements[index:]):
+                        self.execute_statement(query, db, index, StatementScript(statements[index:]))
+                    else:
+                        # Get list of individual specific statements and process them
+                        for index, stmt in enumerate(statements[index:], index):
+                            self.execute_statement(query, db, index, stmt)
+                    succeeded = True
+                finally:
+                    self.optimizer.release(claimed, succeeded)
+                self.executed.add(node)
+            self.fingerprints[node] = fingerprint
+            if self.execution_type == ExecutionType.execute:
+                self.sources[node] = QueryList.source_checksum(query)
+            if not self.cold_run and node not in self.completed:
+                self.checkpoint.add(node)
+            # Keep track of what gets created in the test
+            if self.execution_type == ExecutionType.test and query.action == 'mock':
+                self.created_schemata.add(query.schema)
+        return status
+
+    def release_claim(self, key: Union[str, None], claimed: List[str]):
+        """ Release a run-once statement claimed by a query, as soon as it's executed
+        """
+        if key in claimed:
+            claimed.remove(key)
+            self.optimizer.release([key], True)
+
+    def execute_statement(self, query, db: DB, index: int, stmt: Union[str, StatementScript]):
+        """ Execute a single statement of a query, or a script with all of them, and validate its result
+        """
+        start = datetime.datetime.now()
+        status = 'failed'
+        row_count = None
+        try:
+            if isinstance(stmt, StatementScript):
+                with tracer.span('execute script', 'statement', statement=stmt.text):
+                    db.execute_script(stmt, query)
+            else:
+                with tracer.span('execute', 'statement', statement=stmt.strip()):
+                    db.execute(stmt, query)
+            row_count = db.rowcount
+            if self.execution_type == ExecutionType.estimate and db.estimated_bytes is not None:
+                node = QueryList.node(query)
+                self.estimated_bytes[node] = self.estimated_bytes.get(node, 0) + db.estimated_bytes
+
+            if self.execution_type in (ExecutionType.execute, ExecutionType.staging) and not self.cold_run:
+                # Validate data only when data is computed properly
+                assertion = query.assertion
+                if assertion:
+                    with tracer.span('assertion', 'assertion'):
+                        assertion(rows=db.fetchall())
+            status = 'success'
+        finally:
+            self.history.add(QueryList.node(query), index, start, datetime.datetime.now() - start, row_count, status)
+
+    @staticmethod
+    def node(query) -> Node:
+        """ Node of the dependency graph that a query builds
+        """
+        return query.schema_name, query.table_name
+
+    def can_batch(self, query, db: DB, statements: List[str]) -> bool:
+        """ Whether the statements of a query can be sent as one script. Hand-written statements, and queries whose
+        assertion validates the result of every statement, are executed one by one
+        """
+        return self.batch_statements and db.supports_scripts and len(statements) > 1 \
+            and query.idempotent and query.assertion is None
+
+    def fingerprint(self, query) -> str:
+        """ Checksum of what a query builds, and of the fingerprints of the requested queries it depends on. The DDL
+        around `select_stmt` is left out, since it depends on what the catalog says exists
+        """
+        select_stmt = query.select_stmt() if query.action in QueryList.incremental_actions else None
+        hash_md5 = md5()
+        for part in (query.action, query.name, query.name_mat, str(query.swap_tables), select_stmt or query.query):
+            hash_md5.update(part.encode('utf-8') + b'\0')
+        for up in sorted(self.plan.upstream[QueryList.node(query)]):
+            hash_md5.update(b'\0' + self.fingerprints.get(up, '').encode('utf-8'))
+        return hash_md5.hexdigest()
+
+    @staticmethod
+    def source_checksum(query) -> str:
+        """ Checksum of the SQL file and the action of a query
+        """
+        return md5(f'{query.action}\0{query.query}'.encode('utf-8')).hexdigest()
+
+    def unchanged_since_production(self, graph: DependencyGraph) -> Set[Node]:
+        """ Queries that can be cloned from production: their SQL didn't change since their last successful execute
+        run, and nothing they depend on did
+        """
+        if not self.state.enabled:
+            raise Exception("Clone staging needs the `state` config")
+        production = self.state.load_sources(ExecutionType.execute)
+        changed: Set[Node] = set()
+        for query in self:
+            if production.get(QueryList.node(query)) != QueryList.source_checksum(query):
+                changed.add(QueryList.node(query))
+            # The SQL is read again when the query runs
+            query.unload()
+        changed |= graph.descendants(changed)
+        return {QueryList.node(query) for query in self if query.action in QueryList.clone_actions} - changed
+
+    def clone_production(self):
+        """ Create the relations of unchanged queries as zero-copy clones of production, before anything is built.
+        Queries that the DB can't clone are built as usual
+        """
+        statements: Dict[str, None] = {}
+        for query in self:
+            node = QueryList.node(query)
+            if node not in self.cloned:
+                continue
+            clone_statements = query.clone_stmt()
+            if clone_statements is None:
+                self.cloned.discard(node)
+            else:
+                # Schemata can be cloned as a whole, for several queries
+                statements.update(dict.fromkeys(clone_statements))
+        if not self.cloned:
+            return
+        print(f'Cloning {len(self.cloned)} unchanged queries from production')
+        with tracer.span('cloning', 'statement'):
+            for stmt in statements:
+                self.db.execute(stmt)
+        if self.catalog is not None:
+            self.catalog.invalidate()
+        # A resumed run must not clone over what it already built
+        if not self.cold_run:
+            for node in self.cloned:
+                self.checkpoint.add(node)
+
+    def is_unchanged(self, query, fingerprint: str) -> bool:
+        """ Whether an incremental run can skip the query
+        """
+        node = QueryList.node(query)
+        return self.incremental and query.action in QueryList.incremental_actions \
+            and self.previous_fingerprints.get(node) == fingerprint \
+            and not self.plan.upstream[node] & self.executed
+
+    def failed_upstream(self, node: Node) -> Union[Node, None]:
+        """ The failed query that a query depends on, directly or through skipped queries
+        """
+        for up in sorted(self.plan.upstream[node]):
+            if up in self.failed:
+                return up
+            if up in self.upstream_failed:
+                return self.upstream_failed[up]
+        return None
+
+    def print_failures(self):
+        """ Summary of a `--keep-going` run with failed queries
+        """
+        sys.stderr.write(f'{len(self.failed)} of {len(self)} queries failed, '
+                         f'{len(self.upstream_failed)} skipped because of them:\n')
+        for query in self:
+            node = QueryList.node(query)
+            if node in self.failed:
+                sys.stderr.write(f'\tFAILED  "{node[0]}"."{node[1]}": {self.failed[node]}\n')
+            elif node in self.upstream_failed:
+                up = self.upstream_failed[node]
+                sys.stderr.write(f'\tSKIPPED "{node[0]}"."{node[1]}", because "{up[0]}"."{up[1]}" failed\n')
+
+    def print_resume_hint(self):
+        if self.state.enabled and not self.cold_run \
+                and self.execution_type in (ExecutionType.execute, ExecutionType.staging):
+            print(f'Run {self.checkpoint.run_id} failed. Continue it with `--resume {self.checkpoint.run_id}`',
+                  file=sys.stderr)
+
+    def critical_path(self) -> List[float]:
+        """ For every query, the expected time it takes to run it and the longest chain of queries that depend on it
+        """
+        history = self.state.load_durations(self.execution_type)
+        remaining: Dict[Node, float] = {}
+        for query in reversed(self):
+            node = QueryList.node(query)
+            duration = history.get(node, QueryList.estimated_durations.get(query.action, 10.0))
+            remaining[node] = duration + max((remaining[down] for down in self.plan.downstream[node]), default=0.0)
+        return [remaining[QueryList.node(query)] for query in self]
+
+    def run(self) -> int:
+        """ Execute every statement from every query. Returns the number of failed queries, with `--keep-going`
+        """
+        run_start = datetime.datetime.now()
+        if self.state.enabled and not self.cold_run:
+            print(f'Run id: {self.checkpoint.run_id}')
+        if self.prefetch:
+            self.prefetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch')
+        try:
+            if self.cloned:
+                self.clone_production()
+            if self.jobs > 1:
+                executor = ParallelExecutor(self, self.plan, lambda: self.DBClass(self.config, self.cold_run),
+                                            self.jobs, self.critical_path(),
+                                            self.pools)
+                executor.run(self.run_query)
+            else:
+                for query in self:
+                    self.run_query(query, self.db)
+        except Exception:
+            self.print_resume_hint()
+            raise
+        finally:
+            if self.prefetcher is not None:
+                self.prefetcher.shutdown()
+                self.prefetcher = None
+            # What was measured and built is kept even if the run fails
+            if not self.cold_run:
+                self.state.save_durations(self.execution_type, self.durations)
+                # Rebuilding a relation can drop what depends on it (`DROP ... CASCADE`), also in later runs that
+                # don't rebuild it again, so fingerprints of anything downstream are only kept if it was built too
+                stale = self.started | self.graph.descendants(self.started)
+                self.state.save_fingerprints(self.execution_type, self.fingerprints, stale - self.fingerprints.keys())
+                self.state.save_sources(self.execution_type, self.sources, stale - self.sources.keys())
+                try:
+                    self.history.save(self.db)
+                except Exception as ex:
+                    # The run itself succeeded or failed already, and that's what it reports
+                    sys.stderr.write(f"Couldn't save the run history: {ex}\n")
+        if not self.failed:
+            self.checkpoint.delete()
 
         if self.execution_type == ExecutionType.test:
             # Clean up the temporary views
-            self.db.clean_specific_schemas(created_schemata)
+            with tracer.span('clean up', 'statement'):
+                self.db.clean_specific_schemas(self.created_schemata)
+        self.db.close()
+        self.optimizer.report()
+        if self.execution_type == ExecutionType.estimate:
+            print(f'Estimated {sum(self.estimated_bytes.values()):,} bytes processed by '
+                  f'{len(self.estimated_bytes)} queries')
         print('Run finished in {}'.format(datetime.datetime.now() - run_start))
+        if self.failed:
+            self.print_failures()
+            self.print_resume_hint()
+        return len(self.failed)
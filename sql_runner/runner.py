@@ -2,12 +2,21 @@ import argparse
 import importlib
 import json
 import os
+import sys
 from types import SimpleNamespace
 
+from sql_runner import ExecutionError
+
 
 def main():
     args = parse_args()
-    run(args)
+    try:
+        status = run(args)
+    except ExecutionError:
+        # Details were already written out
+        sys.exit(1)
+    if status:
+        sys.exit(status)
 
 
 def parse_args():
@@ -39,6 +48,20 @@ def parse_args():
         help='Execute statements based on the provided list of CSV command files, in staging schemata',
         nargs='*'
     )
+    command_group.add_argument(
+        '--validate',
+        metavar='csv_file',
+        help='Validate the queries of the provided list of CSV command files against the existing sources, with '
+             '`EXPLAIN` (dry runs on BigQuery), without creating anything',
+        nargs='*'
+    )
+    command_group.add_argument(
+        '--estimate',
+        metavar='csv_file',
+        help='Estimate the bytes that the queries of the provided list of CSV command files would process, with dry '
+             'runs on BigQuery',
+        nargs='*'
+    )
     command_group.add_argument(
         '--deps',
         help='View dependencies graph',
@@ -46,6 +69,13 @@ def parse_args():
         const=True,
         default=False
     )
+    command_group.add_argument(
+        '--report-regressions',
+        help='Report nodes whose duration in their latest run grew beyond a factor of their median duration, from '
+             'the run history',
+        action='store_true',
+        default=False
+    )
     command_group.add_argument(
         '--clean',
         help='Schemata prefix to clean up',
@@ -68,6 +98,66 @@ def parse_args():
         default=False
     )
 
+    parser.add_argument(
+        '-s',
+        '--select',
+        metavar='selector',
+        help='Run only the queries of the CSV files that match any of the selectors: `schema.table`, `schema.*`, '
+             '`+schema.table` with everything it depends on, `schema.table+` with everything that depends on it',
+        nargs='+',
+        default=None
+    )
+
+    parser.add_argument(
+        '--exclude',
+        metavar='selector',
+        help='Don\'t run the queries that match any of the selectors, with the same syntax as `--select`',
+        nargs='+',
+        default=None
+    )
+
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        help='Number of queries to run concurrently, each on its own connection. Queries start as soon as all of '
+             'their dependencies finished',
+        type=int,
+        default=1
+    )
+
+    parser.add_argument(
+        '--incremental',
+        help='Skip tables and views whose statements, and the queries they depend on, didn\'t change since their '
+             'last successful build. Needs the `state` config',
+        action='store_true',
+        default=False
+    )
+
+    parser.add_argument(
+        '--resume',
+        metavar='run_id',
+        help='Continue a failed execute or staging run, running only the queries it didn\'t complete. Needs the '
+             '`state` config',
+        default=None
+    )
+
+    parser.add_argument(
+        '-k',
+        '--keep-going',
+        help='When a query fails, skip only the queries that depend on it and run everything else. The run ends with '
+             'a summary of the failed and skipped queries, and a non-zero exit status',
+        action='store_true',
+        default=False
+    )
+
+    parser.add_argument(
+        '--trace',
+        metavar='trace_file',
+        help='Write the timeline of the run (dependency parsing, planning, every statement and assertion) to a JSON '
+             'file in Chrome trace format',
+        default=None
+    )
+
     parser.add_argument(
         '--cold-run',
         help="Doesn't do any changes to the database. Just outputs the commands it would have run.",
@@ -98,7 +188,23 @@ def get_config(config_path) -> SimpleNamespace:
 
 
 def run(args):
-    from sql_runner import deps, query_list, db, ExecutionType
+    from sql_runner.trace import tracer
+
+    if getattr(args, 'trace', None):
+        tracer.enable()
+    try:
+        return run_command(args)
+    finally:
+        if getattr(args, 'trace', None):
+            tracer.write(args.trace)
+
+
+def run_command(args) -> int:
+    """ Run the requested command, and return the exit status
+    """
+    # Modules are imported by the commands that need them, to keep the start of every run short
+    from sql_runner import deps, ExecutionType
+    from sql_runner.trace import tracer
 
     config = get_config(args.config)
 
@@ -109,7 +215,8 @@ def run(args):
         config.auth['database'] = args.database
         config.sql_path = config.sql_path + args.database
 
-    dependencies = deps.Dependencies(config)
+    with tracer.span('dependency parsing', 'planning'):
+        dependencies = deps.Dependencies(config)
 
     execution_type: ExecutionType = ExecutionType.none
     execution_list: list = []
@@ -122,18 +229,31 @@ def run(args):
     elif args.test:
         execution_type = ExecutionType.test
         execution_list = args.test
+    elif args.validate:
+        execution_type = ExecutionType.validate
+        execution_list = args.validate
+    elif args.estimate:
+        execution_type = ExecutionType.estimate
+        execution_list = args.estimate
 
     if execution_type != ExecutionType.none:
+        from sql_runner import query_list
         qlist = query_list.QueryList.from_csv_files(config, args, execution_list, dependencies.dependencies,
                                                     execution_type)
-        qlist.run()
+        if qlist.run():
+            return 1
 
     elif args.deps:
         schema = config.deps_schema
         dependencies.save(schema)
         dependencies.viz()
+    elif getattr(args, 'report_regressions', False):
+        from sql_runner import history
+        if history.report_regressions(config, dependencies.db):
+            return 1
     elif args.clean:
         dependencies.clean_schemas(args.clean)
+    return 0
 
 
 if __name__ == '__main__':
@@ -0,0 +1,63 @@
+from fnmatch import fnmatchcase
+from typing import List, Set, Iterable, Tuple
+
+from sql_runner.planner import DependencyGraph, Node
+
+
+class NodeSelector:
+    """ Narrows down the queries of a run with selectors over `schema.table` names, resolved on the dependency graph:
+
+        schema.table    the node itself
+        schema.*        every node of the schema (`*` and `?` wildcards work in both parts)
+        +schema.table   the node and everything it depends on, directly or indirectly
+        schema.table+   the node and everything that depends on it, directly or indirectly
+        +schema.table+  both
+
+    Only queries of the CSV files are run, so dependencies that aren't in them are not added.
+    """
+    def __init__(self, graph: DependencyGraph):
+        self.graph: DependencyGraph = graph
+
+    @staticmethod
+    def parse(selector: str) -> Tuple[bool, str, str, bool]:
+        """ Whether ancestors are included, schema and table patterns, and whether descendants are included
+        """
+        with_ancestors = selector.startswith('+')
+        with_descendants = selector.endswith('+')
+        name = selector[int(with_ancestors):len(selector) - int(with_descendants)]
+        if name.count('.') != 1 or '' in name.split('.'):
+            raise Exception(f'Selector "{selector}" has to look like `[+]schema.table[+]`')
+        schema_pattern, table_pattern = name.split('.')
+        return with_ancestors, schema_pattern, table_pattern, with_descendants
+
+    def resolve(self, selector: str, nodes: Set[Node]) -> Set[Node]:
+        """ The nodes that a single selector refers to
+        """
+        with_ancestors, schema_pattern, table_pattern, with_descendants = NodeSelector.parse(selector)
+        matched = {
+            node for node in nodes | set(self.graph.upstream) | set(self.graph.downstream)
+            if fnmatchcase(node[0], schema_pattern) and fnmatchcase(node[1], table_pattern)
+        }
+        if not matched:
+            raise Exception(f'Selector "{selector}" doesn\'t match any query or dependency')
+        selected = set(matched)
+        if with_ancestors:
+            selected |= self.graph.ancestors(matched)
+        if with_descendants:
+            selected |= self.graph.descendants(matched)
+        return selected
+
+    def select(self, nodes: List[Node], selectors: Iterable[str], exclusions: Iterable[str] = ()) -> List[Node]:
+        """ The nodes, in the same order, that any of the selectors refer to and none of the exclusions do.
+        Without selectors, every node is selected
+        """
+        available = set(nodes)
+        selectors = list(selectors or ())
+        selected: Set[Node] = set(available)
+        if selectors:
+            selected = set()
+            for selector in selectors:
+                selected |= self.resolve(selector, available)
+        for exclusion in exclusions or ():
+            selected -= self.resolve(exclusion, available)
+        return [node for node in nodes if node in selected]
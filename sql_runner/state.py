@@ -0,0 +1,162 @@
+import csv
+import datetime
+import os
+import threading
+from types import SimpleNamespace
+from typing import Dict, Iterable, List, Set, Tuple
+
+from sql_runner import ExecutionType
+
+
+class RunState:
+    """ Information about previous runs, kept between invocations. Configured in the same way as the dependency
+    cache, with a `state` config entry:
+
+        "state": {
+            "type": "filesystem",
+            "location": "/path/to/local/state/directory"
+        }
+
+    Without that entry nothing is kept.
+    """
+    def __init__(self, config: SimpleNamespace):
+        self.config = config
+        self.state_config: Dict[str, str] = getattr(config, 'state', None) or {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.state_config.get('type') == 'filesystem'
+
+    def path(self, file_name: str) -> str:
+        return os.path.join(self.state_config['location'], file_name)
+
+    def load_csv(self, file_name: str) -> List[Dict[str, str]]:
+        if not self.enabled or not os.path.exists(self.path(file_name)):
+            return []
+        with open(self.path(file_name), 'r') as fp:
+            return list(csv.DictReader(fp))
+
+    def save_csv(self, file_name: str, header: Tuple[str, ...], rows: List[Tuple]):
+        os.makedirs(self.state_config['location'], exist_ok=True)
+        # Replace the file only when it's completely written
+        with open(self.path(file_name + '.tmp'), 'w') as fp:
+            writer = csv.writer(fp)
+            writer.writerow(header)
+            writer.writerows(rows)
+        os.replace(self.path(file_name + '.tmp'), self.path(file_name))
+
+    def load_node_values(self, file_name: str, value_column: str,
+                         execution_type: ExecutionType) -> Dict[Tuple[str, str], str]:
+        """ Values of a per-node file, for the given execution type
+        """
+        return {
+            (row['schema_name'], row['table_name']): row[value_column]
+            for row in self.load_csv(file_name)
+            if row['execution_type'] == execution_type.value
+        }
+
+    def update_node_values(self, file_name: str, value_column: str, execution_type: ExecutionType,
+                           values: Dict[Tuple[str, str], str], removed: Iterable[Tuple[str, str]] = ()):
+        """ Update the values of a per-node file with the ones from this run, and remove the values of `removed` nodes
+        """
+        removed = set(removed)
+        if not self.enabled or not values and not removed:
+            return
+        rows = {
+            (row['execution_type'], row['schema_name'], row['table_name']): row[value_column]
+            for row in self.load_csv(file_name)
+        }
+        for schema_name, table_name in removed:
+            rows.pop((execution_type.value, schema_name, table_name), None)
+        for (schema_name, table_name), value in values.items():
+            rows[(execution_type.value, schema_name, table_name)] = value
+        self.save_csv(file_name, ('execution_type', 'schema_name', 'table_name', value_column),
+                      [key + (rows[key],) for key in sorted(rows)])
+
+    def load_durations(self, execution_type: ExecutionType) -> Dict[Tuple[str, str], float]:
+        """ Last measured duration in seconds of every node
+        """
+        return {
+            node: float(seconds)
+            for node, seconds in self.load_node_values('durations.csv', 'seconds', execution_type).items()
+        }
+
+    def save_durations(self, execution_type: ExecutionType, durations: Dict[Tuple[str, str], float]):
+        self.update_node_values('durations.csv', 'seconds', execution_type,
+                                {node: f'{seconds:.3f}' for node, seconds in durations.items()})
+
+    def load_fingerprints(self, execution_type: ExecutionType) -> Dict[Tuple[str, str], str]:
+        """ Fingerprint of every node, from its last successful build
+        """
+        return self.load_node_values('fingerprints.csv', 'fingerprint', execution_type)
+
+    def save_fingerprints(self, execution_type: ExecutionType, fingerprints: Dict[Tuple[str, str], str],
+                          removed: Iterable[Tuple[str, str]] = ()):
+        self.update_node_values('fingerprints.csv', 'fingerprint', execution_type, fingerprints, removed)
+
+    def load_sources(self, execution_type: ExecutionType) -> Dict[Tuple[str, str], str]:
+        """ Checksum of the SQL file and action of every node, from its last successful build
+        """
+        return self.load_node_values('sources.csv', 'checksum', execution_type)
+
+    def save_sources(self, execution_type: ExecutionType, checksums: Dict[Tuple[str, str], str],
+                     removed: Iterable[Tuple[str, str]] = ()):
+        self.update_node_values('sources.csv', 'checksum', execution_type, checksums, removed)
+
+
+class Checkpoint:
+    """ List of the nodes completed by a run, written as soon as each node completes, so a failed run can be resumed
+    """
+    def __init__(self, state: RunState, run_id: str, execution_type: ExecutionType):
+        self.state: RunState = state
+        self.run_id: str = run_id
+        self.execution_type: ExecutionType = execution_type
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def new_run_id() -> str:
+        return datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+
+    @property
+    def file_name(self) -> str:
+        return f'runs/{self.run_id}.csv'
+
+    def load(self) -> Set[Tuple[str, str]]:
+        """ Nodes completed by the run so far
+        """
+        if not self.state.enabled:
+            raise Exception("Resuming a run needs the `state` config")
+        if not os.path.exists(self.state.path(self.file_name)):
+            raise Exception(f"There's no checkpoint for run {self.run_id}")
+        completed = set()
+        for row in self.state.load_csv(self.file_name):
+            if row['execution_type'] != self.execution_type.value:
+                raise Exception(f"Run {self.run_id} was a {row['execution_type']} run")
+            completed.add((row['schema_name'], row['table_name']))
+        return completed
+
+    def add(self, node: Tuple[str, str]):
+        """ Mark a node as completed
+        """
+        if not self.state.enabled:
+            return
+        with self.lock:
+            path = self.state.path(self.file_name)
+            is_new = not os.path.exists(path)
+            if is_new:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'a') as fp:
+                writer = csv.writer(fp)
+                if is_new:
+                    writer.writerow(('execution_type', 'schema_name', 'table_name'))
+                writer.writerow((self.execution_type.value,) + tuple(node))
+
+    def delete(self):
+        """ Remove the checkpoint, once the run doesn't have to be resumed anymore
+        """
+        if not self.state.enabled:
+            return
+        with self.lock:
+            path = self.state.path(self.file_name)
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,72 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Any
+
+
+class Tracer:
+    """ Records how long the phases of a run take, and writes them in Chrome trace format, which can be viewed with
+    chrome://tracing or https://ui.perfetto.dev
+    """
+    def __init__(self):
+        self.enabled: bool = False
+        self.events: List[Dict[str, Any]] = []
+        self.thread_names: Dict[int, str] = {}
+        self.lock = threading.Lock()
+        self.origin: float = time.perf_counter()
+
+    def enable(self):
+        self.enabled = True
+        self.origin = time.perf_counter()
+
+    def timestamp(self) -> float:
+        """ Microseconds since the tracer was enabled
+        """
+        return (time.perf_counter() - self.origin) * 1e6
+
+    @contextmanager
+    def span(self, name: str, category: str, **args):
+        """ Record the time spent in the `with` block
+        """
+        if not self.enabled:
+            yield
+            return
+        start = self.timestamp()
+        try:
+            yield
+        finally:
+            end = self.timestamp()
+            thread = threading.current_thread()
+            event = {
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'ts': start,
+                'dur': end - start,
+                'pid': os.getpid(),
+                'tid': thread.ident,
+                'args': args
+            }
+            with self.lock:
+                self.thread_names[thread.ident] = thread.name
+                self.events.append(event)
+
+    def write(self, path: str):
+        """ Write the recorded spans as a Chrome trace JSON file
+        """
+        with self.lock:
+            events = [{
+                'name': 'thread_name',
+                'ph': 'M',
+                'pid': os.getpid(),
+                'tid': tid,
+                'args': {'name': name}
+            } for tid, name in self.thread_names.items()] + self.events
+        with open(path, 'w') as fp:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fp)
+
+
+# Tracer for the whole process
+tracer = Tracer()
@@ -0,0 +1,64 @@
+import os
+import threading
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Tuple
+
+import pytest
+
+from sql_runner import ExecutionType
+from sql_runner import query_list as query_list_module
+from sql_runner.db import DB, Query
+
+
+class RecordingDB(DB):
+    """ Database that only records the statements it executes. `on_execute` runs for every statement, to make
+    statements slow or fail
+    """
+    on_execute: Callable[[str, Query], None] = staticmethod(lambda stmt, query: None)
+    # Statements of every connection, with normalized whitespace
+    statements: List[str] = []
+    lock = threading.Lock()
+    # Rows of the catalog snapshot, with `"catalog_snapshot": true`
+    catalog_stmt = 'catalog'
+    catalog_rows: List[Tuple[str, str, str]] = []
+
+    def execute(self, stmt: str, query: Query = None):
+        RecordingDB.on_execute(stmt, query)
+        with RecordingDB.lock:
+            RecordingDB.statements.append(' '.join(stmt.split()))
+
+    def fetchall(self):
+        return RecordingDB.catalog_rows
+
+
+@pytest.fixture
+def project(tmp_path):
+    """ Writes SQL files of `schema.table` names, and returns a function that builds a query list of them
+    """
+    sql_path = tmp_path / 'sql'
+    RecordingDB.statements = []
+    RecordingDB.catalog_rows = []
+    RecordingDB.on_execute = staticmethod(lambda stmt, query: None)
+
+    def write(files: Dict[str, str]):
+        for name, sql in files.items():
+            schema, table = name.split('.')
+            os.makedirs(sql_path / schema, exist_ok=True)
+            (sql_path / schema / f'{table}.sql').write_text(sql)
+
+    def query_list(queries: List[Tuple[str, str]], execution_type: ExecutionType = ExecutionType.execute,
+                   dependencies: List[Dict] = (), config: Dict = None, **args) -> query_list_module.QueryList:
+        run_config = SimpleNamespace(sql_path=str(sql_path), database_type='postgres', auth={},
+                                     state={'type': 'filesystem', 'location': str(tmp_path / 'state')},
+                                     **(config or {}))
+        run_args = SimpleNamespace(**dict(dict(cold_run=False, except_locally_independent=False), **args))
+        csv_string = '\n'.join(['schema_name;table_name;action'] + [f'{name.replace(".", ";")};{action}'
+                                                                      for name, action in queries])
+        return query_list_module.QueryList(run_config, run_args, csv_string, list(dependencies), execution_type)
+
+    original = query_list_module.get_db_and_query_classes
+    query_list_module.get_db_and_query_classes = lambda config: (RecordingDB, Query)
+    try:
+        yield SimpleNamespace(write=write, query_list=query_list, path=tmp_path, db=RecordingDB)
+    finally:
+        query_list_module.get_db_and_query_classes = original
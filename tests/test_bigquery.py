@@ -0,0 +1,26 @@
+from types import SimpleNamespace
+
+import pytest
+
+from sql_runner import ExecutionType
+
+pytest.importorskip('google.cloud.bigquery')
+from sql_runner.db.bigquery import BigQueryQuery  # noqa: E402
+
+
+def test_merge_stmt_preprocesses_names_once_in_staging(project):
+    project.write({
+        'src.base': 'SELECT 1 AS id',
+        's.inc': '/* unique key (id) */\n/* {"incremental_filter": "id > 0"} */\nSELECT id FROM src.base',
+    })
+    config = SimpleNamespace(sql_path=str(project.path / 'sql'), database_type='bigquery', auth={'database': 'proj'},
+                             staging={'override': {'schema': {'prefix': 'stg_'}}})
+    args = SimpleNamespace(cold_run=True, except_locally_independent=False)
+    query = BigQueryQuery(config, args, {('src', 'base'), ('s', 'inc')}, ExecutionType.staging,
+                          schema_name='s', table_name='inc', action='i')
+    script = ' '.join(query.merge_stmt()[1].split())
+
+    assert 'stg_stg_' not in script
+    # Both the first build and the merge read the staging relation
+    assert script.count('stg_src') == 2
+    assert 'WHERE id > 0' in script
@@ -0,0 +1,100 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from sql_runner.db import DB, ConnectionPool
+
+
+class Connection:
+    def __init__(self):
+        self.healthy = True
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class PooledDB(DB):
+    opened = []
+
+    def open_connection(self):
+        PooledDB.opened.append(Connection())
+        return PooledDB.opened[-1]
+
+    @staticmethod
+    def is_healthy(connection):
+        return connection.healthy
+
+
+@pytest.fixture(autouse=True)
+def pools(monkeypatch):
+    monkeypatch.setattr(ConnectionPool, 'pools', {})
+    PooledDB.opened = []
+
+
+def db(**config):
+    return PooledDB(SimpleNamespace(auth={'database': 'db'}, **config), cold_run=False)
+
+
+def test_released_connection_is_reused():
+    first = db()
+    connection = first.acquire_connection()
+    first.close()
+    assert db().acquire_connection() is connection
+    assert len(PooledDB.opened) == 1
+
+
+def test_connections_in_use_are_not_shared():
+    first, second = db(), db()
+    assert first.acquire_connection() is not second.acquire_connection()
+    assert len(PooledDB.opened) == 2
+
+
+def test_unhealthy_idle_connection_is_replaced():
+    first = db()
+    connection = first.acquire_connection()
+    first.close()
+    connection.healthy = False
+    assert db().acquire_connection() is not connection
+    assert connection.closed
+    assert len(PooledDB.opened) == 2
+
+
+def test_reconnecting_closes_the_broken_connection():
+    instance = db()
+    connection = instance.acquire_connection()
+    assert instance.acquire_connection() is not connection
+    assert connection.closed
+    assert ConnectionPool.of(instance).size == 1
+
+
+def test_pools_are_per_database():
+    first = db()
+    connection = first.acquire_connection()
+    first.close()
+    other = PooledDB(SimpleNamespace(auth={'database': 'other'}), cold_run=False)
+    assert other.acquire_connection() is not connection
+
+
+def test_max_connections_waits_for_a_free_connection():
+    first = db(max_connections=1)
+    connection = first.acquire_connection()
+    acquired = []
+    waiting = threading.Thread(target=lambda: acquired.append(db(max_connections=1).acquire_connection()))
+    waiting.start()
+    waiting.join(0.05)
+    assert acquired == []
+    first.close()
+    waiting.join(1)
+    assert acquired == [connection]
+
+
+def test_close_all_closes_idle_and_used_connections():
+    idle, used = db(), db()
+    idle.acquire_connection()
+    used.acquire_connection()
+    idle.close()
+    ConnectionPool.close_all()
+    assert all(connection.closed for connection in PooledDB.opened)
+    assert ConnectionPool.of(idle).size == 0
@@ -0,0 +1,108 @@
+import builtins
+import multiprocessing
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from sql_runner import deps as deps_module
+from sql_runner.deps import Dependencies
+
+
+def dependencies(project, **config):
+    return Dependencies(SimpleNamespace(sql_path=str(project.path / 'sql'), exclude_dependencies=[], **config))
+
+
+def test_parsing_in_processes_gives_the_same_dependencies(project):
+    project.write({f's.t{i}': f'SELECT * FROM s.t{i - 1} JOIN x.src ON 1=1' for i in range(1, 9)})
+    assert dependencies(project, deps_workers=2).dependencies == dependencies(project, deps_workers=1).dependencies
+
+
+@pytest.mark.parametrize('start_method, workers', [('fork', 4), ('spawn', 1), ('forkserver', 1)])
+def test_processes_by_default_only_where_forked(monkeypatch, start_method, workers):
+    monkeypatch.setattr(multiprocessing, 'get_start_method', lambda: start_method)
+    monkeypatch.setattr(os, 'cpu_count', lambda: 4)
+    assert Dependencies.worker_count(SimpleNamespace()) == workers
+    assert Dependencies.worker_count(SimpleNamespace(deps_workers=3)) == 3
+
+
+# Modification time of the files, long enough before the scan for it to be cached
+MTIME_NS = 1_600_000_000_000_000_000
+
+
+@pytest.fixture
+def cached(project, monkeypatch):
+    """ Writes SQL files with an old modification time, and returns a function that scans them with the dependency
+    cache, and the SQL files it read
+    """
+    def write(files):
+        project.write(files)
+        for name in files:
+            schema, table = name.split('.')
+            os.utime(project.path / 'sql' / schema / f'{table}.sql', ns=(MTIME_NS, MTIME_NS))
+
+    def scan():
+        read = []
+
+        def tracked_open(file, *args, **kwargs):
+            if str(file).endswith('.sql'):
+                read.append(os.path.basename(os.path.dirname(file)) + '.' + os.path.basename(file)[:-4])
+            return builtins.open(file, *args, **kwargs)
+        monkeypatch.setattr(deps_module, 'open', tracked_open, raising=False)
+        try:
+            scanned = dependencies(project, deps_workers=1,
+                                   deps_cache={'type': 'filesystem', 'location': str(project.path / 'deps.csv')})
+        finally:
+            monkeypatch.delattr(deps_module, 'open')
+        return scanned.dependencies, read
+    return SimpleNamespace(write=write, scan=scan)
+
+
+def test_unchanged_files_are_not_read(cached):
+    cached.write({'s.a': 'SELECT * FROM src.x', 's.b': 'SELECT * FROM s.a'})
+    parsed, read = cached.scan()
+    assert read == ['s.a', 's.b']
+    assert cached.scan() == (parsed, [])
+
+
+@pytest.mark.parametrize('change', ['size', 'mtime', 'version'])
+def test_changed_files_are_parsed_again(cached, project, monkeypatch, change):
+    cached.write({'s.a': 'SELECT * FROM src.x', 's.b': 'SELECT * FROM s.a'})
+    cached.scan()
+    path = project.path / 'sql' / 's' / 'b.sql'
+    if change == 'size':
+        cached.write({'s.b': 'SELECT * FROM s.a JOIN src.y ON 1=1'})
+    elif change == 'mtime':
+        # Same size, other modification time
+        path.write_text('SELECT * FROM s.c')
+        os.utime(path, ns=(MTIME_NS + 1, MTIME_NS + 1))
+    else:
+        monkeypatch.setattr(Dependencies, 'VERSION', Dependencies.VERSION + b'-next')
+    parsed, read = cached.scan()
+    assert read == (['s.a', 's.b'] if change == 'version' else ['s.b'])
+    sources = {(d['source_schema'], d['source_table']) for d in parsed if d['dependent_table'] == 'b'}
+    assert sources == {'size': {('s', 'a'), ('src', 'y')}, 'mtime': {('s', 'c')}, 'version': {('s', 'a')}}[change]
+
+
+@pytest.mark.skipif(not os.environ.get('SQL_RUNNER_BENCHMARK'), reason='benchmark, run with SQL_RUNNER_BENCHMARK=1')
+def test_benchmark_parsing_in_processes(project):
+    project.write({f's{i % 20}.t{i}': f"""
+        WITH recent AS (
+            SELECT id, max(updated_at) AS updated_at FROM s{(i + 1) % 20}.t{i - 1} GROUP BY id
+        )
+        SELECT a.*, b.value, coalesce(c.name, 'none') AS name
+        FROM recent a
+        JOIN src.events b ON a.id = b.id AND b.updated_at > (SELECT max(updated_at) FROM s0.t0)
+        LEFT JOIN (SELECT id, name FROM src.names UNION ALL SELECT id, name FROM src.aliases) c ON c.id = a.id
+        WHERE a.id IN (SELECT id FROM s{i % 7}.t{i // 2})
+        """ for i in range(1, 1001)})
+    timings = {}
+    results = {}
+    # At least two processes, so that parsing in processes is compared even on one CPU
+    for workers in (1, max(2, os.cpu_count() or 1)):
+        start = time.perf_counter()
+        results[workers] = dependencies(project, deps_workers=workers).dependencies
+        timings[workers] = time.perf_counter() - start
+    print(' '.join(f'{workers} workers: {seconds:.2f}s' for workers, seconds in timings.items()))
+    assert results[1] and len(set(map(str, results.values()))) == 1
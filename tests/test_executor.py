@@ -0,0 +1,52 @@
+import threading
+
+import pytest
+
+from sql_runner import ExecutionError
+from sql_runner.executor import ResourcePools
+
+
+@pytest.mark.parametrize('pools', [
+    {'loads': {'slots': 0}},
+    {'loads': {'actions': ['t']}},
+    {'loads': {'slots': '2'}},
+    {'loads': {'slots': 2, 'schemas': '^x_'}},
+    {'loads': {'slots': 2, 'actions': 't'}},
+    {'loads': {'slots': 2, 'schemas': ['(']}},
+    ['loads'],
+])
+def test_invalid_pools_are_rejected(project, pools):
+    project.write({'s.a': 'SELECT 1 AS x'})
+    with pytest.raises(Exception, match='(?i)pool'):
+        project.query_list([('s.a', 't')], jobs=2, config={'pools': pools})
+
+
+def test_pool_limits_concurrency(project):
+    project.write({f's.t{i}': f'SELECT {i} AS x' for i in range(4)})
+    running = []
+    most_running = []
+    lock = threading.Lock()
+
+    def on_execute(stmt, query):
+        if stmt.strip().startswith('CREATE TABLE'):
+            with lock:
+                running.append(stmt)
+                most_running.append(len(running))
+            threading.Event().wait(0.02)
+            with lock:
+                running.remove(stmt)
+    project.db.on_execute = staticmethod(on_execute)
+
+    qlist = project.query_list([(f's.t{i}', 't') for i in range(4)], jobs=4,
+                               config={'pools': {'loads': {'slots': 1, 'schemas': ['^s$']}}})
+    assert qlist.run() == 0
+    assert max(most_running) == 1
+    assert len(most_running) == 4
+
+
+def test_queries_stuck_without_slot_raise(project, monkeypatch):
+    project.write({'s.a': 'SELECT 1 AS x'})
+    qlist = project.query_list([('s.a', 't')], jobs=2, config={'pools': {'loads': {'slots': 1}}})
+    monkeypatch.setattr(ResourcePools, 'has_free_slot', lambda self, name: False)
+    with pytest.raises(ExecutionError, match='s.a'):
+        qlist.run()
@@ -0,0 +1,10 @@
+def test_failing_to_save_the_run_history_is_only_a_warning(project, capsys):
+    project.write({'s.a': 'SELECT 1 AS x'})
+
+    def on_execute(stmt, query):
+        if 'run_history' in stmt:
+            raise Exception('permission denied for schema monitor')
+    project.db.on_execute = staticmethod(on_execute)
+    qlist = project.query_list([('s.a', 't')], config={'run_history': True, 'deps_schema': 'monitor'})
+    assert qlist.run() == 0
+    assert "Couldn't save the run history: permission denied for schema monitor" in capsys.readouterr().err
@@ -0,0 +1,27 @@
+import os
+import subprocess
+import sys
+
+# Modules of the `--execute` path
+EXECUTE_PATH = ['sql_runner.runner', 'sql_runner.query_list', 'sql_runner.deps', 'sql_runner.history']
+# Only `--deps`, S3 uploads and the configured database type need these
+OPTIONAL = ['networkx', 'pydot', 'boto3', 'botocore', 'psycopg2', 'snowflake', 'google', 'pyodbc']
+# Generous, so that slow machines pass, but it still catches heavy modules on the path
+BUDGET_SECONDS = 2.0
+
+
+def test_execute_path_doesnt_import_optional_dependencies():
+    code = ('import sys\n' + ''.join(f'import {module}\n' for module in EXECUTE_PATH)
+            + f'print(" ".join(sorted({{m.split(".")[0] for m in sys.modules}} & {set(OPTIONAL)!r})))')
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), check=True)
+    assert result.stdout.split() == []
+
+    # Lines of `import time: self [us] | cumulative | imported package`, with top-level imports indented by one space
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            cumulative[fields[2].rstrip()] = int(fields[1])
+    total = sum(cumulative.get(f' {module}', 0) for module in EXECUTE_PATH) / 1e6
+    assert 0 < total < BUDGET_SECONDS
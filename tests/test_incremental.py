@@ -0,0 +1,75 @@
+import time
+
+from sql_runner import ExecutionType
+
+
+def create_table_statements(statements):
+    return [stmt for stmt in statements if stmt.startswith('CREATE TABLE')]
+
+
+def test_unchanged_query_is_skipped(project):
+    project.write({'s.a': 'SELECT 1 AS x'})
+    assert project.query_list([('s.a', 't')], incremental=True).run() == 0
+    assert project.query_list([('s.a', 't')], incremental=True).run() == 0
+    assert len(create_table_statements(project.db.statements)) == 1
+
+
+def test_failed_rebuild_is_not_skipped_next_time(project):
+    project.write({'s.a': 'SELECT 1 AS x'})
+    assert project.query_list([('s.a', 't')], incremental=True).run() == 0
+
+    def on_execute(stmt, query):
+        if stmt.strip().startswith('CREATE TABLE'):
+            raise Exception('CTAS failed')
+    project.db.on_execute = staticmethod(on_execute)
+    # The table was dropped before the CTAS failed
+    assert project.query_list([('s.a', 't')], keep_going=True).run() == 1
+
+    project.db.on_execute = staticmethod(lambda stmt, query: None)
+    project.db.statements.clear()
+    assert project.query_list([('s.a', 't')], incremental=True).run() == 0
+    assert len(create_table_statements(project.db.statements)) == 1
+
+
+def test_skipped_and_failed_queries_keep_measured_durations(project):
+    project.write({'s.a': 'SELECT 1 AS x', 's.b': 'SELECT 2 AS x'})
+
+    def slow(stmt, query):
+        if stmt.strip().startswith('CREATE TABLE'):
+            time.sleep(0.05)
+    project.db.on_execute = staticmethod(slow)
+    qlist = project.query_list([('s.a', 't'), ('s.b', 't')], incremental=True)
+    assert qlist.run() == 0
+
+    def fail_b(stmt, query):
+        if stmt.strip().startswith('CREATE TABLE s.b'):
+            raise Exception('CTAS failed')
+    project.db.on_execute = staticmethod(fail_b)
+    # s.a is skipped as unchanged, and s.b is changed and fails
+    project.write({'s.b': 'SELECT 3 AS x'})
+    assert project.query_list([('s.a', 't'), ('s.b', 't')], incremental=True, keep_going=True).run() == 1
+    durations = qlist.state.load_durations(ExecutionType.execute)
+    assert durations[('s', 'a')] >= 0.05
+    assert durations[('s', 'b')] >= 0.05
+
+
+def test_dependent_of_a_table_rebuilt_in_an_earlier_run_is_not_skipped(project):
+    project.write({'s.t': 'SELECT 1 AS x', 's.v': 'SELECT x FROM s.t'})
+    dependencies = [dict(md5='', source_schema='s', source_table='t', dependent_schema='s', dependent_table='v')]
+    assert project.query_list([('s.t', 't'), ('s.v', 'v')], dependencies=dependencies, incremental=True).run() == 0
+    # Dropping and creating s.t again drops the view s.v with it
+    assert project.query_list([('s.t', 't')], dependencies=dependencies).run() == 0
+
+    project.db.statements.clear()
+    assert project.query_list([('s.t', 't'), ('s.v', 'v')], dependencies=dependencies, incremental=True).run() == 0
+    assert [stmt for stmt in project.db.statements if stmt.startswith('CREATE VIEW')]
+
+
+def test_fingerprint_doesnt_depend_on_the_catalog(project):
+    project.write({'s.a': 'SELECT 1 AS x'})
+    config = {'catalog_snapshot': True}
+    # Nothing exists yet, so the first build creates the schema and doesn't drop the table
+    assert project.query_list([('s.a', 't')], incremental=True, config=config).run() == 0
+    project.db.catalog_rows = [('s', 'a', 'table')]
+    assert project.query_list([('s.a', 't')], incremental=True, config=config).run() == 0
+    assert len(create_table_statements(project.db.statements)) == 1
@@ -0,0 +1,27 @@
+MERGED = '/* unique key (id) */ SELECT 1 AS id, 2 AS x'
+
+
+def test_first_build_without_a_catalog_creates_the_missing_table(project, monkeypatch):
+    monkeypatch.setattr(project.db, 'catalog_stmt', None)
+    project.write({'s.m': MERGED})
+    assert project.query_list([('s.m', 'i')]).run() == 0
+    statements = project.db.statements
+    guard = statements.index('CREATE TABLE IF NOT EXISTS s.m (LIKE s.m__incr)')
+    assert 'CREATE SCHEMA IF NOT EXISTS s' in statements[:guard]
+    assert statements[guard - 1].startswith('CREATE TABLE s.m__incr AS')
+    assert any(stmt.startswith('DELETE FROM s.m USING') for stmt in statements[guard + 1:])
+
+
+def test_table_in_the_catalog_is_merged_without_a_guard(project):
+    project.db.catalog_rows = [('s', 'm', 'table')]
+    project.write({'s.m': MERGED})
+    assert project.query_list([('s.m', 'i')]).run() == 0
+    assert not any('IF NOT EXISTS' in stmt for stmt in project.db.statements)
+    assert any(stmt.startswith('DELETE FROM s.m USING') for stmt in project.db.statements)
+
+
+def test_table_missing_from_the_catalog_is_created(project):
+    project.write({'s.m': MERGED})
+    assert project.query_list([('s.m', 'i')]).run() == 0
+    assert not any('s.m__incr' in stmt for stmt in project.db.statements)
+    assert any(stmt.startswith('CREATE TABLE s.m AS') for stmt in project.db.statements)
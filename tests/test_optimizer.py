@@ -0,0 +1,71 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from sql_runner import query_list as query_list_module
+from sql_runner.optimizer import StatementOptimizer
+
+
+def test_same_schema_queries_run_concurrently(project):
+    project.write({f's.t{i}': f'SELECT {i} AS x' for i in range(4)})
+    # Every CTAS waits for all the others, so this only passes if they run at the same time
+    barrier = threading.Barrier(4, timeout=5)
+
+    def on_execute(stmt, query):
+        if stmt.strip().startswith('CREATE TABLE'):
+            barrier.wait()
+    project.db.on_execute = staticmethod(on_execute)
+
+    qlist = project.query_list([(f's.t{i}', 't') for i in range(4)], jobs=4)
+    assert qlist.run() == 0
+    assert project.db.statements.count('CREATE SCHEMA IF NOT EXISTS s') == 1
+
+
+def test_failed_run_once_statement_is_run_by_next_query(project):
+    project.write({'s.a': 'SELECT 1 AS x', 's.b': 'SELECT 2 AS x'})
+    failures = []
+
+    def on_execute(stmt, query):
+        if stmt.strip().startswith('CREATE SCHEMA') and not failures:
+            failures.append(stmt)
+            raise Exception('schema creation failed')
+    project.db.on_execute = staticmethod(on_execute)
+
+    qlist = project.query_list([('s.a', 't'), ('s.b', 't')], keep_going=True)
+    assert qlist.run() == 1
+    assert project.db.statements.count('CREATE SCHEMA IF NOT EXISTS s') == 1
+
+
+def test_run_once_key():
+    assert StatementOptimizer.run_once_key('\n  CREATE SCHEMA IF NOT EXISTS s;\n') == 'CREATE SCHEMA IF NOT EXISTS s'
+    assert StatementOptimizer.run_once_key('CREATE TABLE s.t AS SELECT 1') is None
+
+
+def test_claimed_statements_go_first():
+    statements = ['CREATE TABLE s_mat.t AS SELECT 1', 'CREATE SCHEMA IF NOT EXISTS s', 'CREATE VIEW s.t AS SELECT 1']
+    optimizer = StatementOptimizer()
+    optimized, claimed = optimizer.optimize(SimpleNamespace(idempotent=True), statements)
+    assert optimized == ['CREATE SCHEMA IF NOT EXISTS s', 'CREATE TABLE s_mat.t AS SELECT 1',
+                         'CREATE VIEW s.t AS SELECT 1']
+    assert claimed == ['CREATE SCHEMA IF NOT EXISTS s']
+
+
+def test_claimed_schema_is_released_before_the_rest_of_the_query(project, monkeypatch):
+    pytest.importorskip('psycopg2')
+    from sql_runner.db.redshift import RedshiftQuery
+    monkeypatch.setattr(query_list_module, 'get_db_and_query_classes', lambda config: (project.db, RedshiftQuery))
+    project.write({'s.m': 'SELECT 1 AS x', 's.v': 'SELECT 2 AS x'})
+    view_created = threading.Event()
+
+    def on_execute(stmt, query):
+        # s.m's table waits for the view s.v, which needs the schema `s` that s.m creates after its table
+        if stmt.strip().startswith('CREATE TABLE s_mat.m'):
+            assert view_created.wait(5)
+        if stmt.strip().startswith('CREATE VIEW s.v'):
+            view_created.set()
+    project.db.on_execute = staticmethod(on_execute)
+
+    qlist = project.query_list([('s.m', 'm'), ('s.v', 'v')], jobs=2)
+    assert qlist.run() == 0
+    assert project.db.statements.count('CREATE SCHEMA IF NOT EXISTS s') == 1
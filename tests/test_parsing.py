@@ -0,0 +1,71 @@
+import glob
+import os
+
+import pytest
+
+from sql_runner.parsing import Query
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Statements that the lightweight lexer has to parse like `sqlparse.parse`
+CORPUS = [
+    'SELECT * FROM s.a',
+    'SELECT * FROM s.a JOIN s.b ON 1=1 LEFT JOIN "q"."r" r USING (id)',
+    'SELECT * FROM s.a, s.b AS b, db.s.c',
+    'CREATE TABLE s.t AS SELECT * FROM x_raw.src',
+    'CREATE OR REPLACE VIEW v.w AS SELECT date_trunc(\'day\', t) d, sum(x) OVER (PARTITION BY y) FROM s.t',
+    'WITH a AS (SELECT EXTRACT(YEAR FROM d) y, SUBSTRING(s FROM 2) AS s2, TRIM(BOTH \'x\' FROM s) FROM x.y) '
+    'SELECT * FROM a',
+    'INSERT INTO s.t SELECT * FROM s.a WHERE z::int > 2 LIMIT 3',
+    'INSERT INTO x.tt (a, b) SELECT a, b FROM y.uu',
+    'DELETE FROM x.y WHERE a IN (SELECT 1 FROM k.l)',
+    'UPDATE u.v SET a = 1 FROM w.z',
+    'MERGE INTO a.b USING c.d ON a.b.id = c.d.id WHEN MATCHED THEN UPDATE SET x = 1',
+    'SELECT count(*) FROM (SELECT * FROM s.a UNION ALL SELECT * FROM s.b) sub WHERE EXISTS (SELECT 1 FROM s.c)',
+    'SELECT COALESCE((SELECT max(a) FROM m.n), 1) AS x FROM s.t',
+    'SELECT x FROM s.t WHERE y = \'FROM z.q\' AND w = "FROM"',
+    'SELECT CAST(a AS int), position(\'a\' IN s) FROM s.f',
+    'SELECT fn (1) FROM s.g',
+    'SELECT [a].[b] FROM [c].[d]',
+    'SELECT * FROM `proj.ds.tbl` t CROSS JOIN UNNEST(arr) a',
+    'CREATE TABLE x.tt (a int, b numeric(10, 2))',
+    '/* unique key (id) */\n/* {"incremental_filter": "id > 0"} */\nSELECT id FROM s.a -- trailing\n',
+    '-- {"override_dependencies": [["s", "b"]]}\nSELECT * FROM s.a',
+    'SELECT 1; SELECT * FROM s.a;\nDROP TABLE s.b',
+] + [
+    open(path).read()
+    for path in sorted(glob.glob(os.path.join(REPOSITORY, 'sql', '**', '*.sql'), recursive=True) +
+                       glob.glob(os.path.join(REPOSITORY, 'selftest*', '**', '*.sql'), recursive=True))
+]
+
+# Known differences, where the lightweight lexer can't tell without grouping: FROM within an aliased subquery within a
+# function call is taken as part of the function, so the subquery's sources are missed
+KNOWN_DIFFERENCES = [
+    'SELECT f((SELECT a FROM m.n) x) FROM s.t',
+    'SELECT f((SELECT a FROM m.n) AS x) FROM s.t',
+]
+
+
+def parsed(sql: str, lightweight: bool):
+    return [
+        (query.tokens_as_str(), [str(source) for source in query.sources()], str(query.destination()),
+         query.comment_contents(), str(query))
+        for query in Query.get_queries(sql, lightweight=lightweight)
+    ]
+
+
+@pytest.mark.parametrize('sql', CORPUS)
+def test_lightweight_lexer_conforms(sql):
+    assert parsed(sql, lightweight=True) == parsed(sql, lightweight=False)
+
+
+@pytest.mark.parametrize('sql', KNOWN_DIFFERENCES)
+@pytest.mark.xfail(strict=True, reason='aliased subquery within a function call')
+def test_lightweight_lexer_known_differences(sql):
+    assert parsed(sql, lightweight=True) == parsed(sql, lightweight=False)
+
+
+def test_comment_contents_can_be_read_again():
+    query = next(Query.get_queries('/* {"a": 1} */ SELECT 1'))
+    assert query.comment_contents() == ['{"a": 1}']
+    assert query.comment_contents() == ['{"a": 1}']
@@ -0,0 +1,56 @@
+import pytest
+
+from sql_runner import ExecutionType
+from sql_runner.planner import DependencyGraph, Planner
+
+
+def edges(*pairs):
+    """ Dependencies of `source > dependent` pairs of `schema.table` names
+    """
+    dependencies = []
+    for pair in pairs:
+        source, dependent = (name.split('.') for name in pair.split(' > '))
+        dependencies.append(dict(md5='', source_schema=source[0], source_table=source[1],
+                                 dependent_schema=dependent[0], dependent_table=dependent[1]))
+    return dependencies
+
+
+def test_plan_is_topological_with_ties_as_requested():
+    planner = Planner(DependencyGraph(edges('s.a > s.b', 's.b > s.c', 's.a > s.d')))
+    plan = planner.plan([('s', 'd'), ('s', 'c'), ('s', 'b'), ('s', 'x'), ('s', 'a')])
+    assert plan.order == [('s', 'x'), ('s', 'a'), ('s', 'd'), ('s', 'b'), ('s', 'c')]
+    assert plan.layers == [[('s', 'x'), ('s', 'a')], [('s', 'd'), ('s', 'b')], [('s', 'c')]]
+
+
+def test_plan_relates_requested_nodes_through_the_others():
+    planner = Planner(DependencyGraph(edges('s.a > s.b', 's.b > s.c')))
+    plan = planner.plan([('s', 'c'), ('s', 'a')])
+    assert plan.order == [('s', 'a'), ('s', 'c')]
+    assert plan.upstream[('s', 'c')] == {('s', 'a')}
+    assert plan.downstream[('s', 'a')] == {('s', 'c')}
+
+
+def test_cycle_is_reported(capsys):
+    planner = Planner(DependencyGraph(edges('s.x > s.a', 's.a > s.b', 's.b > s.c', 's.c > s.a')))
+    with pytest.raises(RecursionError, match='Cyclical dependency detected'):
+        planner.plan([('s', 'x'), ('s', 'c'), ('s', 'a'), ('s', 'b')])
+    assert capsys.readouterr().err == ('Error: "s"."c" generates a cyclical dependency:\n'
+                                       '\trequired by "s"."a"\n'
+                                       '\trequired by "s"."b"\n'
+                                       '\trequired by "s"."c"\n')
+
+
+@pytest.mark.parametrize('durations, started', [
+    # s.short goes first, since s.next is waiting for it
+    ({'long': 5.0, 'short': 1.0, 'next': 10.0}, ['short', 'next', 'long']),
+    ({'long': 100.0, 'short': 1.0, 'next': 10.0}, ['long', 'short', 'next']),
+])
+def test_ready_queries_start_by_critical_path(project, durations, started):
+    project.write({'s.long': 'SELECT 1 AS x', 's.short': 'SELECT 2 AS x', 's.next': 'SELECT x FROM s.short'})
+    # One slot, so that only one query runs at a time
+    qlist = project.query_list([('s.long', 't'), ('s.short', 't'), ('s.next', 't')],
+                               dependencies=edges('s.short > s.next'), jobs=2,
+                               config={'pools': {'loads': {'slots': 1}}})
+    qlist.state.save_durations(ExecutionType.execute, {('s', name): seconds for name, seconds in durations.items()})
+    assert qlist.run() == 0
+    assert [stmt.split()[2][2:] for stmt in project.db.statements if stmt.startswith('CREATE TABLE')] == started
@@ -0,0 +1,38 @@
+import threading
+
+from sql_runner.query_list import QueryList
+
+
+def test_query_that_finished_while_it_was_prefetched_is_dropped(project):
+    project.write({'s.a': 'SELECT 1 AS x', 's.b': 'SELECT 2 AS x'})
+    qlist = project.query_list([('s.a', 't'), ('s.b', 't')], config={'prefetch_queries': 1})
+    query = qlist[1]
+    finished = threading.Event()
+    load, unload = query.load, query.unload
+
+    def slow_load():
+        # Only done after s.b ran and was dropped
+        finished.wait(2)
+        load()
+
+    def unload_and_notify():
+        unload()
+        if ('s', 'b') in qlist.finished:
+            finished.set()
+    query.load, query.unload = slow_load, unload_and_notify
+
+    assert qlist.run() == 0
+    assert finished.is_set()
+    assert query._query is None and query._managed_statements is None
+
+
+def test_parallel_runs_prefetch_the_queries_that_become_ready(project):
+    project.write({'s.a': 'SELECT 1 AS x', 's.b': 'SELECT 2 AS x', 's.c': 'SELECT x FROM s.a'})
+    dependencies = [dict(md5='', source_schema='s', source_table='a', dependent_schema='s', dependent_table='c')]
+    qlist = project.query_list([('s.a', 't'), ('s.b', 't'), ('s.c', 't')], dependencies=dependencies, jobs=2,
+                               config={'prefetch_queries': 1})
+    assert [QueryList.node(query) for query in qlist] == [('s', 'a'), ('s', 'b'), ('s', 'c')]
+    assert qlist.run() == 0
+    # s.b is next in the list, but it's ready right away, and s.c is the one that waits for s.a
+    assert qlist.prefetched == {('s', 'c')}
+    assert all(query._query is None for query in qlist)
@@ -0,0 +1,33 @@
+import os
+
+import pytest
+
+QUERIES = [('s.a', 't'), ('s.b', 't'), ('s.c', 't')]
+DEPENDENCIES = [dict(md5='', source_schema='s', source_table='a', dependent_schema='s', dependent_table='b')]
+
+
+def created_tables(statements):
+    return [stmt.split()[2] for stmt in statements if stmt.startswith('CREATE TABLE')]
+
+
+def test_resumed_run_only_runs_incomplete_queries(project):
+    project.write({'s.a': 'SELECT 1 AS x', 's.b': 'SELECT x FROM s.a', 's.c': 'SELECT 3 AS x'})
+
+    def fail_b(stmt, query):
+        if stmt.split()[:3] == ['CREATE', 'TABLE', 's.b']:
+            raise Exception('CTAS failed')
+    project.db.on_execute = staticmethod(fail_b)
+    failed = project.query_list(QUERIES, dependencies=DEPENDENCIES, keep_going=True)
+    assert failed.run() == 1
+    run_id = failed.checkpoint.run_id
+    checkpoint = failed.state.path(failed.checkpoint.file_name)
+    assert os.path.exists(checkpoint)
+
+    project.db.on_execute = staticmethod(lambda stmt, query: None)
+    project.db.statements.clear()
+    assert project.query_list(QUERIES, dependencies=DEPENDENCIES, resume=run_id).run() == 0
+    assert created_tables(project.db.statements) == ['s.b']
+    assert not os.path.exists(checkpoint)
+
+    with pytest.raises(Exception, match=f"There's no checkpoint for run {run_id}"):
+        project.query_list(QUERIES, dependencies=DEPENDENCIES, resume=run_id)
@@ -0,0 +1,93 @@
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from sql_runner import db as db_module
+from sql_runner.db import DB, RetryPolicy
+
+
+class Transient(Exception):
+    pass
+
+
+class Disconnected(Transient):
+    pass
+
+
+class FlakyDB(DB):
+    """ Fails with the given errors, one per call, and succeeds after them
+    """
+    def __init__(self, errors, attempts=3):
+        super().__init__(SimpleNamespace(retry={'attempts': attempts, 'base_delay': 1.0, 'max_delay': 3.0}), False)
+        self.errors = list(errors)
+        self.calls = []
+
+    def connect(self):
+        self.calls.append('connect')
+
+    def is_transient_error(self, error):
+        return isinstance(error, Transient)
+
+    def needs_reconnect(self, error):
+        return isinstance(error, Disconnected)
+
+    def attempt(self):
+        self.calls.append('execute')
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'result'
+
+
+QUERY = SimpleNamespace(name='s.t', idempotent=True)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """ Delays slept for, with the longest delay that the jitter allows
+    """
+    delays = []
+    monkeypatch.setattr(db_module.time, 'sleep', delays.append)
+    monkeypatch.setattr(random, 'uniform', lambda low, high: high)
+    return delays
+
+
+def test_backoff_is_exponential_up_to_the_maximum(sleeps):
+    policy = RetryPolicy(SimpleNamespace(retry={'base_delay': 0.5, 'max_delay': 3.0}))
+    assert [policy.delay(attempt) for attempt in range(1, 5)] == [1.0, 2.0, 3.0, 3.0]
+    assert RetryPolicy(SimpleNamespace()).attempts == 3
+
+
+def test_transient_errors_are_retried_until_success(sleeps):
+    db = FlakyDB([Transient(), Transient()])
+    assert db.execute_with_retry(db.attempt, QUERY) == 'result'
+    assert db.calls == ['execute'] * 3
+    assert sleeps == [2.0, 3.0]
+
+
+def test_retries_stop_after_the_last_attempt(sleeps):
+    db = FlakyDB([Transient()] * 5, attempts=4)
+    with pytest.raises(Transient):
+        db.execute_with_retry(db.attempt, QUERY)
+    assert db.calls == ['execute'] * 4
+    assert len(sleeps) == 3
+
+
+def test_reconnects_before_retrying(sleeps):
+    db = FlakyDB([Disconnected()])
+    assert db.execute_with_retry(db.attempt, QUERY) == 'result'
+    assert db.calls == ['execute', 'connect', 'execute']
+
+
+@pytest.mark.parametrize('error, query', [
+    (ValueError('syntax error'), QUERY),
+    # Hand-written statements can't be repeated safely
+    (Transient(), SimpleNamespace(name='s.t', idempotent=False)),
+    (Transient(), None),
+])
+def test_other_errors_are_raised_immediately(sleeps, error, query):
+    db = FlakyDB([error])
+    with pytest.raises(type(error)):
+        db.execute_with_retry(db.attempt, query)
+    assert db.calls == ['execute']
+    assert sleeps == []
@@ -0,0 +1,55 @@
+import pytest
+
+from sql_runner.query_list import QueryList
+
+QUERIES = [('s.a', 't'), ('s.b', 'v'), ('s.c', 't'), ('s.d', 't'), ('x.e', 'v')]
+# s.a > s.b > s.c, and x.e depends on s.a through src.raw, which isn't a query
+EDGES = [('s', 'a', 's', 'b'), ('s', 'b', 's', 'c'), ('s', 'a', 'src', 'raw'), ('src', 'raw', 'x', 'e')]
+
+
+def selected(project, select=None, exclude=None):
+    project.write({name: 'SELECT 1 AS x' for name, _ in QUERIES})
+    dependencies = [dict(md5='', source_schema=source_schema, source_table=source_table,
+                         dependent_schema=dependent_schema, dependent_table=dependent_table)
+                    for source_schema, source_table, dependent_schema, dependent_table in EDGES]
+    qlist = project.query_list(QUERIES, dependencies=dependencies, select=select, exclude=exclude)
+    return ['.'.join(QueryList.node(query)) for query in qlist]
+
+
+@pytest.mark.parametrize('select, names', [
+    (None, ['s.a', 's.b', 's.c', 's.d', 'x.e']),
+    (['s.b'], ['s.b']),
+    (['+s.b'], ['s.a', 's.b']),
+    (['s.b+'], ['s.b', 's.c']),
+    (['+s.b+'], ['s.a', 's.b', 's.c']),
+    # Through src.raw, which isn't run
+    (['s.a+'], ['s.a', 's.b', 's.c', 'x.e']),
+    (['+x.e'], ['s.a', 'x.e']),
+    (['s.*'], ['s.a', 's.b', 's.c', 's.d']),
+    (['*.?'], ['s.a', 's.b', 's.c', 's.d', 'x.e']),
+    (['s.[cd]', 'x.e'], ['s.c', 's.d', 'x.e']),
+])
+def test_selectors(project, select, names):
+    assert selected(project, select) == names
+
+
+@pytest.mark.parametrize('select, exclude, names', [
+    (None, ['s.*'], ['x.e']),
+    (['s.a+'], ['s.b'], ['s.a', 's.c', 'x.e']),
+    # Exclusions win over selectors, also when they select the same nodes
+    (['s.a+'], ['s.a+'], []),
+    (['s.b'], ['+s.c'], []),
+])
+def test_exclusions_take_precedence(project, select, exclude, names):
+    assert selected(project, select, exclude) == names
+
+
+@pytest.mark.parametrize('select, exclude, message', [
+    (['s.z'], None, 'Selector "s.z" doesn\'t match any query or dependency'),
+    (None, ['y.*'], 'Selector "y.\\*" doesn\'t match any query or dependency'),
+    (['s'], None, 'has to look like'),
+    (['s.a.b'], None, 'has to look like'),
+])
+def test_invalid_selectors_fail(project, select, exclude, message):
+    with pytest.raises(Exception, match=message):
+        selected(project, select, exclude)
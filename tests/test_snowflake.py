@@ -0,0 +1,73 @@
+from types import SimpleNamespace
+
+import pytest
+
+from sql_runner import ExecutionError
+from sql_runner.db import StatementScript
+
+pytest.importorskip('snowflake.connector')
+import snowflake.connector.errors  # noqa: E402
+from sql_runner.db.snowflake import SnowflakeDB  # noqa: E402
+
+
+class ScriptCursor:
+    """ Fails scripts, and has the second statement of the script as the latest failed query in the history
+    """
+    def __init__(self):
+        self.executed = []
+
+    def execute(self, stmt, **kwargs):
+        self.executed.append(stmt)
+        if 'num_statements' in kwargs:
+            raise snowflake.connector.errors.Error('SQL compilation error: error line 1 at position 7')
+
+    def fetchall(self):
+        return [('CREATE TABLE s.t AS SELECT x FROM s.missing;',), ('SELECT 1',)]
+
+
+def test_failed_script_is_not_repeated(capsys):
+    db = SnowflakeDB(SimpleNamespace(auth={'database': 'db'}), cold_run=True)
+    db.cursor = ScriptCursor()
+    script = StatementScript(['CREATE SCHEMA IF NOT EXISTS s', 'CREATE TABLE s.t\nAS SELECT x FROM s.missing'])
+
+    with pytest.raises(ExecutionError):
+        db.execute_script(script)
+    # Only the script and the query history lookup, no statement of the script again
+    assert len(db.cursor.executed) == 2
+    assert 'query_history_by_session' in db.cursor.executed[1]
+    error = capsys.readouterr().err
+    assert 'CREATE TABLE s.t\nAS SELECT x FROM s.missing' in error
+    assert 'CREATE SCHEMA' not in error
+
+
+class FlakyCursor:
+    """ Fails the first script with a transient error, of a request that Snowflake accepted if `sfqid` is set
+    """
+    def __init__(self, sfqid):
+        self.sfqid = sfqid
+        self.executed = []
+
+    def execute(self, stmt, **kwargs):
+        self.executed.append(stmt)
+        if 'num_statements' in kwargs and len(self.executed) == 1:
+            error = snowflake.connector.errors.Error('Warehouse is resuming, try again')
+            error.sfqid = self.sfqid
+            raise error
+
+    def fetchall(self):
+        return []
+
+
+@pytest.mark.parametrize('sfqid, attempts', [(None, 2), ('01a2b3c4', 1)])
+def test_script_is_only_retried_when_it_was_not_accepted(sfqid, attempts):
+    db = SnowflakeDB(SimpleNamespace(auth={'database': 'db'}, retry={'base_delay': 0}), cold_run=True)
+    db.cursor = FlakyCursor(sfqid)
+    script = StatementScript(['CREATE SCHEMA IF NOT EXISTS s', 'CREATE TABLE s.t AS SELECT 1 AS x'])
+    query = SimpleNamespace(name='s.t', path='s/t.sql', idempotent=True)
+
+    if attempts == 1:
+        with pytest.raises(ExecutionError):
+            db.execute_script(script, query)
+    else:
+        db.execute_script(script, query)
+    assert db.cursor.executed.count(script.text) == attempts
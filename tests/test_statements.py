@@ -0,0 +1,98 @@
+import importlib
+from types import SimpleNamespace
+
+import pytest
+
+from sql_runner import ExecutionType
+
+
+def query_of(project, database_type, class_name, action='t', execution_type=ExecutionType.execute, **config):
+    """ Query of `s.t` for a back-end, skipped where its driver isn't installed
+    """
+    project.write({'s.t': 'SELECT 1 AS x'})
+    module = importlib.import_module('sql_runner.db')
+    if database_type is not None:
+        pytest.importorskip({'snowflake': 'snowflake.connector', 'azuredwh': 'pyodbc',
+                             'bigquery': 'google.cloud.bigquery'}[database_type])
+        module = importlib.import_module(f'sql_runner.db.{database_type}')
+    run_config = SimpleNamespace(sql_path=str(project.path / 'sql'), auth={'database': 'db'}, **config)
+    args = SimpleNamespace(cold_run=True, except_locally_independent=False)
+    return getattr(module, class_name)(run_config, args, {('s', 't')}, execution_type, schema_name='s',
+                                       table_name='t', action=action)
+
+
+def rendered(statements):
+    return [' '.join(stmt.split()) for stmt in statements if stmt is not None]
+
+
+BACKENDS = [(None, 'Query'), ('snowflake', 'SnowflakeQuery'), ('azuredwh', 'AzureDwhQuery')]
+
+
+@pytest.mark.parametrize('database_type, class_name', BACKENDS)
+def test_swap_without_swap_tables_is_only_what_follows(project, database_type, class_name):
+    query = query_of(project, database_type, class_name)
+    assert query.swap_stmt(then=('GRANT SELECT ON s.t TO r', None)) == ('GRANT SELECT ON s.t TO r', None)
+
+
+@pytest.mark.parametrize('mat, name', [(False, 's.t'), (True, 's_mat.t')])
+def test_swap(project, mat, name):
+    query = query_of(project, None, 'Query', swap_tables=True)
+    assert rendered(query.swap_stmt(mat, then=('GRANT SELECT ON s.t TO r;',))) == [
+        f'DROP TABLE IF EXISTS {name} CASCADE; ALTER TABLE {name}__swap RENAME TO t; GRANT SELECT ON s.t TO r;'
+    ]
+
+
+@pytest.mark.parametrize('mat, name', [(False, 's.t'), (True, 's_mat.t')])
+def test_snowflake_swap(project, mat, name):
+    query = query_of(project, 'snowflake', 'SnowflakeQuery', swap_tables=True)
+    assert rendered(query.swap_stmt(mat, then=('GRANT SELECT ON s.t TO r',))) == [
+        f'CREATE TABLE IF NOT EXISTS {name} LIKE {name}__swap',
+        f'ALTER TABLE {name} SWAP WITH {name}__swap',
+        f'DROP TABLE {name}__swap',
+        'GRANT SELECT ON s.t TO r',
+    ]
+
+
+@pytest.mark.parametrize('mat, schema', [(False, 's'), (True, 's_mat')])
+def test_azure_swap(project, mat, schema):
+    query = query_of(project, 'azuredwh', 'AzureDwhQuery', swap_tables=True)
+    statements = rendered(query.swap_stmt(mat))
+    assert [stmt.split(')', 1)[-1].strip() for stmt in statements] == [
+        f'DROP TABLE {schema}.t__swap_old',
+        f'RENAME OBJECT {schema}.t TO t__swap_old',
+        f'DROP VIEW {schema}.t',
+        f'RENAME OBJECT {schema}.t__swap TO t',
+        f'DROP TABLE {schema}.t__swap_old',
+    ]
+    assert f"'{schema}'" in statements[1]
+
+
+STAGING = {'override': {'schema': {'prefix': 'stg_'}}}
+
+
+@pytest.mark.parametrize('action, clones', [
+    ('t', ['CREATE OR REPLACE SCHEMA stg_s CLONE s']),
+    ('m', ['CREATE OR REPLACE SCHEMA stg_s CLONE s', 'CREATE OR REPLACE SCHEMA stg_s_mat CLONE s_mat']),
+])
+def test_snowflake_clone(project, action, clones):
+    query = query_of(project, 'snowflake', 'SnowflakeQuery', action, ExecutionType.staging, staging=STAGING)
+    assert rendered(query.clone_stmt()) == clones
+
+
+@pytest.mark.parametrize('action, clones', [
+    ('t', ['CREATE SCHEMA IF NOT EXISTS `db.stg_s`', 'CREATE OR REPLACE TABLE `db.stg_s.t` CLONE `db.s.t`']),
+    ('m', ['CREATE SCHEMA IF NOT EXISTS `db.stg_s_mat`',
+           'CREATE OR REPLACE TABLE `db.stg_s_mat.t` CLONE `db.s_mat.t`',
+           'CREATE SCHEMA IF NOT EXISTS `db.stg_s`',
+           'CREATE OR REPLACE VIEW `db.stg_s.t` AS SELECT * FROM `db.stg_s_mat.t`']),
+])
+def test_bigquery_clone(project, action, clones):
+    query = query_of(project, 'bigquery', 'BigQueryQuery', action, ExecutionType.staging, staging=STAGING)
+    assert rendered(query.clone_stmt()) == clones
+
+
+@pytest.mark.parametrize('database_type, class_name', [('snowflake', 'SnowflakeQuery'), ('bigquery', 'BigQueryQuery')])
+def test_schemata_excepted_from_staging_are_not_cloned(project, database_type, class_name):
+    staging = dict(STAGING, **{'except': 'schema == "s"'})
+    query = query_of(project, database_type, class_name, 'm', ExecutionType.staging, staging=staging)
+    assert rendered(query.clone_stmt()) == []